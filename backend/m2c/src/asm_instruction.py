@@ -11,6 +11,17 @@ from .error import DecompFailure
 class Register:
     register_name: str
 
+    # Registers are used as dict keys and compared all over the translation
+    # process, so provide simpler versions of the generated __eq__/__hash__,
+    # which would build a tuple of fields on every call.
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Register):
+            return NotImplemented
+        return self.register_name == other.register_name
+
+    def __hash__(self) -> int:
+        return hash(self.register_name)
+
     def is_float(self) -> bool:
         name = self.register_name
         return bool(name) and name[0] == "f" and name != "fp"
@@ -86,6 +86,7 @@ class InstrRef(Reference):
         ref = InstrRef(instr, self.block)
         index = self.block.instruction_refs.index(self)
         self.block.instruction_refs.insert(index, ref)
+        self.block.clear_caches()
         return ref
 
     def replace_instruction(self, new_asm: AsmInstruction, arch: ArchFlowGraph) -> None:
@@ -98,7 +99,12 @@ class InstrRef(Reference):
         for loc in old_instr.outputs + old_instr.clobbers:
             if loc not in new_instr.clobbers:
                 new_instr.clobbers.append(loc)
-        self.instruction = new_instr
+        self.set_instruction(new_instr)
+
+    def set_instruction(self, instr: Instruction) -> None:
+        """Point this reference at `instr`, invalidating the Block's caches."""
+        self.instruction = instr
+        self.block.clear_caches()
 
 
 @dataclass(eq=False)
@@ -114,10 +120,49 @@ class Block:
     # correctly. To access it, use the get_block_info method from translate.py.
     block_info: object = None
 
+    # Lazily computed summaries of the block's instructions, see clear_caches()
+    _register_writes: Optional[List[Tuple[Register, Instruction]]] = field(
+        default=None, repr=False
+    )
+    _last_writes: Optional[Dict[Location, Optional[Instruction]]] = field(
+        default=None, repr=False
+    )
+
     @property
     def instructions(self) -> Iterator[Instruction]:
         return (r.instruction for r in self.instruction_refs)
 
+    def clear_caches(self) -> None:
+        """Must be called whenever instruction_refs or its instructions change."""
+        self._register_writes = None
+        self._last_writes = None
+
+    def register_writes(self) -> List[Tuple[Register, Instruction]]:
+        """All (register, instruction) pairs for registers that are outputs of the
+        block's instructions, in instruction order."""
+        if self._register_writes is None:
+            self._register_writes = [
+                (loc, instr)
+                for instr in self.instructions
+                for loc in instr.outputs
+                if isinstance(loc, Register)
+            ]
+        return self._register_writes
+
+    def last_writes(self) -> Dict[Location, Optional[Instruction]]:
+        """Map each location that is written to by the block to the last instruction
+        that outputs it, or to None if it is clobbered after the last output."""
+        if self._last_writes is None:
+            last_writes: Dict[Location, Optional[Instruction]] = {}
+            for ref in reversed(self.instruction_refs):
+                instr = ref.instruction
+                for loc in instr.outputs:
+                    last_writes.setdefault(loc, instr)
+                for loc in instr.clobbers:
+                    last_writes.setdefault(loc, None)
+            self._last_writes = last_writes
+        return self._last_writes
+
     def add_block_info(self, block_info: object) -> None:
         assert self.block_info is None
         self.block_info = block_info
@@ -1358,21 +1403,35 @@ def phi_loc_sources(node: Node, loc: Location, imdom_srcs: RefSet) -> RefSet:
     return sources
 
 
-def locs_clobbered_until_dominator(node: Node) -> Set[Location]:
+def nodes_until_dominator(node: Node) -> List[Node]:
+    """All nodes on some control flow path from the immediate dominator of `node`
+    to `node`, excluding the dominator itself."""
     assert node.immediate_dominator is not None
 
     seen = {node.immediate_dominator}
     stack = node.parents[:]
-    clobbered = set()
+    ret = []
     while stack:
         n = stack.pop()
         if n in seen:
             continue
         seen.add(n)
-        for instr in n.block.instructions:
-            clobbered.update(instr.outputs)
-            clobbered.update(instr.clobbers)
+        ret.append(n)
         stack.extend(n.parents)
+    return ret
+
+
+def locs_clobbered_until_dominator(
+    node: Node, nodes: Optional[List[Node]] = None
+) -> Set[Location]:
+    """Locations that may be written to between the immediate dominator of `node`
+    and `node`. `nodes` may be passed in if nodes_until_dominator(node) is already
+    known."""
+    if nodes is None:
+        nodes = nodes_until_dominator(node)
+    clobbered: Set[Location] = set()
+    for n in nodes:
+        clobbered.update(n.block.last_writes())
     return clobbered
 
 
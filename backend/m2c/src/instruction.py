@@ -119,7 +119,7 @@ class Instruction:
     # but this use classes that are defined in translate.py. We're unable to use correct
     # types here without creating circular dependencies.
     # The return value is ignored, but is typed as `object` so lambdas are more ergonomic.
-    # This member should only be accessed by `evaluate_instruction`.
+    # This member should only be accessed by `translate_node_body`.
     eval_fn: Optional[Callable[..., object]]
 
     jump_target: Optional[Union[JumpTarget, Register]] = None
@@ -409,8 +409,8 @@ def simplify_ir_patterns(
                     flow_graph.clear_instruction_inputs(cand_ref)
                 elif not cand_ref.instruction.in_pattern:
                     # It needs to be kept; but ensure the meta.in_pattern flag is set
-                    cand_ref.instruction = replace(
-                        cand_ref.instruction, in_pattern=True
+                    cand_ref.set_instruction(
+                        replace(cand_ref.instruction, in_pattern=True)
                     )
 
     # After all of the rewrites above, verify that the instruction dependency
@@ -1,6 +1,5 @@
 import abc
 from collections import defaultdict
-from contextlib import contextmanager
 from dataclasses import dataclass, field, replace
 import math
 import struct
@@ -13,7 +12,7 @@ from typing import (
     Collection,
     DefaultDict,
     Dict,
-    Iterator,
+    FrozenSet,
     List,
     Mapping,
     Optional,
@@ -35,6 +34,7 @@ from .flow_graph import (
     SwitchNode,
     TerminalNode,
     locs_clobbered_until_dominator,
+    nodes_until_dominator,
 )
 from .ir_pattern import IrPattern, simplify_ir_patterns
 from .options import CodingStyle, Formatter, Options, Target
@@ -53,7 +53,6 @@ from .instruction import (
     InstrProcessingFailure,
     StackLocation,
     Location,
-    current_instr,
 )
 from .types import (
     AccessPath,
@@ -104,9 +103,22 @@ class Arch(ArchFlowGraph):
         simplify_ir_patterns(self, flow_graph, self.ir_patterns)
 
 
-ASSOCIATIVE_OPS: Set[str] = {"+", "&&", "||", "&", "|", "^", "*"}
-COMPOUND_ASSIGNMENT_OPS: Set[str] = {"+", "-", "*", "/", "%", "&", "|", "^", "<<", ">>"}
-PSEUDO_FUNCTION_OPS: Set[str] = {"MULT_HI", "MULTU_HI", "DMULT_HI", "DMULTU_HI", "CLZ"}
+ASSOCIATIVE_OPS: FrozenSet[str] = frozenset({"+", "&&", "||", "&", "|", "^", "*"})
+COMPOUND_ASSIGNMENT_OPS: FrozenSet[str] = frozenset(
+    {"+", "-", "*", "/", "%", "&", "|", "^", "<<", ">>"}
+)
+PSEUDO_FUNCTION_OPS: FrozenSet[str] = frozenset(
+    {"MULT_HI", "MULTU_HI", "DMULT_HI", "DMULTU_HI", "CLZ"}
+)
+# Operations that fold_divmod is able to simplify
+MULT_HIGH_OPS: FrozenSet[str] = frozenset({"MULT_HI", "MULTU_HI"})
+DIVMOD_MATCH_OPS: FrozenSet[str] = MULT_HIGH_OPS | {"-", "+", ">>"}
+
+# Precompiled big-endian formats, for reinterpreting raw data and immediates
+BE_U32 = struct.Struct(">I")
+BE_U64 = struct.Struct(">Q")
+BE_F32 = struct.Struct(">f")
+BE_F64 = struct.Struct(">d")
 
 
 def as_type(expr: "Expression", type: Type, silent: bool) -> "Expression":
@@ -241,12 +253,16 @@ class StackInfo:
     is_leaf: bool = True
     is_variadic: bool = False
     uses_framepointer: bool = False
+    # Registers that point to the stack frame: sp, and fp if uses_framepointer
+    stack_regs: Set[Register] = field(default_factory=set)
     subroutine_arg_top: int = 0
     callee_save_regs: Set[Register] = field(default_factory=set)
     callee_save_reg_region: Tuple[int, int] = (0, 0)
     unique_type_map: Dict[Tuple[str, object], "Type"] = field(default_factory=dict)
     local_vars: List["LocalVar"] = field(default_factory=list)
     temp_vars: List["Var"] = field(default_factory=list)
+    # Whether to record Var.debug_exprs; they are only used by --pdb-translate
+    keep_debug_exprs: bool = False
     naive_phi_vars: List["NaivePhiExpr"] = field(default_factory=list)
     reg_vars: Dict[Register, "Var"] = field(default_factory=dict)
     planned_vars: Dict[Tuple[Register, InstructionSource], "Var"] = field(
@@ -461,6 +477,27 @@ class StackInfo:
             return var
         return self.planned_vars.get((reg, source))
 
+    def get_common_planned_var(
+        self, reg: Register, sources: List[InstructionSource]
+    ) -> Optional["Var"]:
+        """If all sources have the same planned var for reg, return it. Equivalent
+        to checking get_planned_var for each source, but with the reg_vars lookup
+        done only once."""
+        reg_var = self.reg_vars.get(reg)
+        common_var: Optional[Var] = None
+        for i, source in enumerate(sources):
+            if reg_var and source is not None and source.function_target is None:
+                var: Optional[Var] = reg_var
+            else:
+                var = self.planned_vars.get((reg, source))
+            if var is None:
+                return None
+            if i == 0:
+                common_var = var
+            elif var != common_var:
+                return None
+        return common_var
+
     def get_persistent_planned_var(
         self, reg: Register, source: InstructionSource
     ) -> PlannedVar:
@@ -476,13 +513,6 @@ class StackInfo:
     def is_planned_inherited_phi(self, node: Node, reg: Register) -> bool:
         return (reg, node) in self.persistent_state.planned_inherited_phis
 
-    def is_stack_reg(self, reg: Register) -> bool:
-        if reg == self.global_info.arch.stack_pointer_reg:
-            return True
-        if reg == self.global_info.arch.frame_pointer_reg:
-            return self.uses_framepointer
-        return False
-
     def get_struct_type_map(self) -> Dict["Expression", Dict[int, Type]]:
         """Reorganize struct information in unique_type_map by var & offset"""
         struct_type_map: Dict[Expression, Dict[int, Type]] = {}
@@ -515,6 +545,7 @@ def get_stack_info(
 ) -> StackInfo:
     arch = global_info.arch
     info = StackInfo(function, persistent_state, global_info, flow_graph)
+    info.stack_regs.add(arch.stack_pointer_reg)
 
     # The goal here is to pick out special instructions that provide information
     # about this function's stack setup.
@@ -562,7 +593,9 @@ def get_stack_info(
         ):
             # "move fp, sp" very likely means the code is compiled with frame
             # pointers enabled; thus fp should be treated the same as sp.
+            assert arch.frame_pointer_reg is not None
             info.uses_framepointer = True
+            info.stack_regs.add(arch.frame_pointer_reg)
         elif (
             arch_mnemonic
             in [
@@ -743,10 +776,12 @@ class Var:
 
 
 class Expression(abc.ABC):
+    # Allow subclasses to use __slots__
+    __slots__ = ()
     type: Type
 
     @abc.abstractmethod
-    def dependencies(self) -> List["Expression"]:
+    def dependencies(self) -> Tuple["Expression", ...]:
         ...
 
     def use(self) -> None:
@@ -777,12 +812,17 @@ class Expression(abc.ABC):
 
 
 class Condition(Expression):
+    __slots__ = ()
+
     @abc.abstractmethod
     def negated(self) -> "Condition":
         ...
 
 
 class Statement(abc.ABC):
+    # Allow subclasses to use __slots__
+    __slots__ = ()
+
     @abc.abstractmethod
     def should_write(self) -> bool:
         ...
@@ -804,8 +844,8 @@ class ErrorExpr(Condition):
     desc: Optional[str] = None
     type: Type = field(default_factory=Type.any_reg)
 
-    def dependencies(self) -> List[Expression]:
-        return []
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return ()
 
     def negated(self) -> "Condition":
         return self
@@ -823,8 +863,8 @@ class CommentExpr(Expression):
     prefix: Optional[str] = None
     suffix: Optional[str] = None
 
-    def dependencies(self) -> List[Expression]:
-        return [self.expr]
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return (self.expr,)
 
     def format(self, fmt: Formatter) -> str:
         expr_str = self.expr.format(fmt)
@@ -849,8 +889,8 @@ class CommentExpr(Expression):
 class SecondF64Half(Expression):
     type: Type = field(default_factory=Type.any_reg)
 
-    def dependencies(self) -> List[Expression]:
-        return []
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return ()
 
     def format(self, fmt: Formatter) -> str:
         return "(second half of f64)"
@@ -860,8 +900,8 @@ class SecondF64Half(Expression):
 class CarryBit(Expression):
     type: Type = field(default_factory=Type.intish)
 
-    def dependencies(self) -> List[Expression]:
-        return []
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return ()
 
     def format(self, fmt: Formatter) -> str:
         return "M2C_CARRY"
@@ -877,6 +917,7 @@ class CarryBit(Expression):
 
 @dataclass(frozen=True, eq=False)
 class BinaryOp(Condition):
+    __slots__ = ("left", "op", "right", "type")
     left: Expression
     op: str
     right: Expression
@@ -1034,8 +1075,8 @@ class BinaryOp(Condition):
             type=Type.bool(),
         )
 
-    def dependencies(self) -> List[Expression]:
-        return [self.left, self.right]
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return (self.left, self.right)
 
     def normalize_for_formatting(self) -> "BinaryOp":
         right_expr = late_unwrap(self.right)
@@ -1105,13 +1146,14 @@ class BinaryOp(Condition):
 
 @dataclass(frozen=True, eq=False)
 class TernaryOp(Expression):
+    __slots__ = ("cond", "left", "right", "type")
     cond: Condition
     left: Expression
     right: Expression
     type: Type
 
-    def dependencies(self) -> List[Expression]:
-        return [self.cond, self.left, self.right]
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return (self.cond, self.left, self.right)
 
     def format(self, fmt: Formatter) -> str:
         cond_str = simplify_condition(self.cond).format(fmt)
@@ -1122,12 +1164,13 @@ class TernaryOp(Expression):
 
 @dataclass(frozen=True, eq=False)
 class UnaryOp(Condition):
+    __slots__ = ("op", "expr", "type")
     op: str
     expr: Expression
     type: Type
 
-    def dependencies(self) -> List[Expression]:
-        return [self.expr]
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return (self.expr,)
 
     @staticmethod
     def sint(op: str, expr: Expression) -> "UnaryOp":
@@ -1157,8 +1200,8 @@ class ExprCondition(Condition):
     type: Type
     is_negated: bool = False
 
-    def dependencies(self) -> List[Expression]:
-        return [self.expr]
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return (self.expr,)
 
     def negated(self) -> "Condition":
         return ExprCondition(self.expr, self.type, not self.is_negated)
@@ -1174,9 +1217,9 @@ class CommaConditionExpr(Condition):
     condition: "Condition"
     type: Type = Type.bool()
 
-    def dependencies(self) -> List[Expression]:
+    def dependencies(self) -> Tuple[Expression, ...]:
         assert False, "CommaConditionExpr should not be used within translate.py"
-        return []
+        return ()
 
     def negated(self) -> "Condition":
         return CommaConditionExpr(self.statements, self.condition.negated())
@@ -1195,8 +1238,8 @@ class Cast(Expression):
     reinterpret: bool = False
     silent: bool = True
 
-    def dependencies(self) -> List[Expression]:
-        return [self.expr]
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return (self.expr,)
 
     def use(self) -> None:
         # Try to unify, to make stringification output better.
@@ -1253,12 +1296,13 @@ class Cast(Expression):
 
 @dataclass(frozen=True, eq=False)
 class FuncCall(Expression):
+    __slots__ = ("function", "args", "type")
     function: Expression
     args: List[Expression]
     type: Type
 
-    def dependencies(self) -> List[Expression]:
-        return self.args + [self.function]
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return (*self.args, self.function)
 
     def format(self, fmt: Formatter) -> str:
         # TODO: The function type may have a different number of params than it had
@@ -1274,8 +1318,8 @@ class LocalVar(Expression):
     type: Type = field(compare=False)
     path: Optional[AccessPath] = field(compare=False)
 
-    def dependencies(self) -> List[Expression]:
-        return []
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return ()
 
     def format(self, fmt: Formatter) -> str:
         fallback_name = f"unksp{format_hex(self.value)}"
@@ -1302,12 +1346,13 @@ class LocalVar(Expression):
 
 @dataclass(frozen=True, eq=False)
 class PlannedPhiExpr(Expression):
+    __slots__ = ("var", "type", "sources")
     var: Var
     type: Type
     sources: List[InstructionSource]
 
-    def dependencies(self) -> List[Expression]:
-        return []
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return ()
 
     def format(self, fmt: Formatter) -> str:
         return self.var.format(fmt)
@@ -1319,8 +1364,8 @@ class PassedInArg(Expression):
     stack_info: StackInfo = field(compare=False, repr=False)
     type: Type = field(compare=False)
 
-    def dependencies(self) -> List[Expression]:
-        return []
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return ()
 
     def format(self, fmt: Formatter) -> str:
         assert self.value % 4 == 0
@@ -1333,8 +1378,8 @@ class SubroutineArg(Expression):
     value: int
     type: Type = field(compare=False)
 
-    def dependencies(self) -> List[Expression]:
-        return []
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return ()
 
     def format(self, fmt: Formatter) -> str:
         return f"subroutine_arg{format_hex(self.value // 4)}"
@@ -1399,8 +1444,8 @@ class StructAccess(Expression):
                 static_assert_unreachable(p)
         return output
 
-    def dependencies(self) -> List[Expression]:
-        return [self.struct_var]
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return (self.struct_var,)
 
     def make_reference(self) -> Optional["StructAccess"]:
         field_path = self.late_field_path()
@@ -1488,8 +1533,8 @@ class ArrayAccess(Expression):
     index: Expression
     type: Type = field(compare=False)
 
-    def dependencies(self) -> List[Expression]:
-        return [self.ptr, self.index]
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return (self.ptr, self.index)
 
     def format(self, fmt: Formatter) -> str:
         base = parenthesize_for_struct_access(self.ptr, fmt)
@@ -1507,8 +1552,8 @@ class GlobalSymbol(Expression):
     initializer_in_typemap: bool = False
     demangled_str: Optional[str] = None
 
-    def dependencies(self) -> List[Expression]:
-        return []
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return ()
 
     def is_string_constant(self) -> bool:
         ent = self.asm_data_entry
@@ -1576,8 +1621,8 @@ class Literal(Expression):
     type: Type = field(compare=False, default_factory=Type.any)
     elide_cast: bool = field(compare=False, default=False)
 
-    def dependencies(self) -> List[Expression]:
-        return []
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return ()
 
     def format(self, fmt: Formatter, force_dec: bool = False) -> str:
         enum_name = self.type.get_enum_name(self.value)
@@ -1624,13 +1669,27 @@ class Literal(Expression):
         return self.value % 2**15 in (0, 2**15 - 1) and self.value < 0x1000000
 
 
+# Shared literals for equality checks on hot paths, which saves allocating a new
+# Literal (and type) for every comparison. Since types are mutable, these must
+# never become part of an output expression.
+LITERAL_ZERO = Literal(0)
+LITERAL_FOUR = Literal(4)
+LITERAL_31 = Literal(31)
+LITERAL_FF = Literal(0xFF)
+LITERAL_FFFF = Literal(0xFFFF)
+
+
 @dataclass(frozen=True, eq=True)
 class AddressOf(Expression):
     expr: Expression
     type: Type = field(compare=False, default_factory=Type.ptr)
+    # Cached result of should_wrap_transparently(expr)
+    _wrap_transparently: Optional[bool] = field(
+        default=None, init=False, compare=False, repr=False
+    )
 
-    def dependencies(self) -> List[Expression]:
-        return [self.expr]
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return (self.expr,)
 
     def format(self, fmt: Formatter) -> str:
         if isinstance(self.expr, GlobalSymbol):
@@ -1656,8 +1715,8 @@ class Lwl(Expression):
     key: Tuple[int, object]
     type: Type = field(compare=False, default_factory=Type.any_reg)
 
-    def dependencies(self) -> List[Expression]:
-        return [self.load_expr]
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return (self.load_expr,)
 
     def format(self, fmt: Formatter) -> str:
         return f"M2C_LWL({self.load_expr.format(fmt)})"
@@ -1668,8 +1727,8 @@ class Load3Bytes(Expression):
     load_expr: Expression
     type: Type = field(compare=False, default_factory=Type.any_reg)
 
-    def dependencies(self) -> List[Expression]:
-        return [self.load_expr]
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return (self.load_expr,)
 
     def format(self, fmt: Formatter) -> str:
         if fmt.valid_syntax:
@@ -1682,8 +1741,8 @@ class UnalignedLoad(Expression):
     load_expr: Expression
     type: Type = field(compare=False, default_factory=Type.any_reg)
 
-    def dependencies(self) -> List[Expression]:
-        return [self.load_expr]
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return (self.load_expr,)
 
     def format(self, fmt: Formatter) -> str:
         if fmt.valid_syntax:
@@ -1725,11 +1784,11 @@ class EvalOnceExpr(Expression):
     # the phi.
     is_used: bool = False
 
-    def dependencies(self) -> List[Expression]:
+    def dependencies(self) -> Tuple[Expression, ...]:
         # (this is a bit iffy since state can change over time, but improves uses_expr)
         if self.uses_var():
-            return []
-        return [self.wrapped_expr]
+            return ()
+        return (self.wrapped_expr,)
 
     def use(self) -> None:
         if self.trivial or (self.transparent and not self.var.is_emitted):
@@ -1817,8 +1876,8 @@ class NaivePhiExpr(Expression):
     num_usages: int = 0
     replacement_expr: Optional[Expression] = None
 
-    def dependencies(self) -> List[Expression]:
-        return []
+    def dependencies(self) -> Tuple[Expression, ...]:
+        return ()
 
     def get_var_name(self) -> str:
         return self.name or f"unnamed-phi({self.reg.register_name})"
@@ -1941,7 +2000,7 @@ class SwitchControl:
         if (
             not isinstance(mul_expr, BinaryOp)
             or mul_expr.op != "*"
-            or early_unwrap(mul_expr.right) != Literal(4)
+            or early_unwrap(mul_expr.right) != LITERAL_FOUR
         ):
             return error_expr
         control_expr = mul_expr.left
@@ -1964,6 +2023,7 @@ class SwitchControl:
 
 @dataclass
 class EvalOnceStmt(Statement):
+    __slots__ = ("expr",)
     expr: EvalOnceExpr
 
     def should_write(self) -> bool:
@@ -2109,6 +2169,7 @@ RegExpression = Union[EvalOnceExpr, PlannedPhiExpr, NaivePhiExpr]
 
 @dataclass
 class RegData:
+    __slots__ = ("value", "meta")
     value: RegExpression
     meta: RegMeta
 
@@ -2119,6 +2180,15 @@ class RegInfo:
     contents: Dict[Register, RegData] = field(default_factory=dict)
     read_inherited: Set[Register] = field(default_factory=set)
     active_instr: Optional[Instruction] = None
+    # Registers holding EvalOnceExpr's whose meta does not have `force` set, i.e.
+    # the candidates for NodeState._prevent_later_uses. Kept in sync with `contents`.
+    _unforced_regs: Set[Register] = field(default_factory=set, init=False, repr=False)
+    # Registers whose current values are known not to contain function calls or
+    # reads, respectively. The transitive dependencies of an expression can only
+    # shrink over time (EvalOnceExpr's stop forwarding them once they use a var),
+    # so this stays true until the register is written to again.
+    call_free_regs: Set[Register] = field(default_factory=set, init=False, repr=False)
+    read_free_regs: Set[Register] = field(default_factory=set, init=False, repr=False)
 
     def __getitem__(self, key: Register) -> Expression:
         if self.active_instr is not None and key not in self.active_instr.inputs:
@@ -2159,7 +2229,7 @@ class RegInfo:
         if key not in self.active_instr.outputs:
             raise DecompFailure(f"Undeclared write to {key} in {self.active_instr}")
         assert key != Register("zero")
-        self.contents[key] = RegData(value, meta)
+        self._set_data(key, RegData(value, meta))
 
     def global_set_with_meta(
         self, key: Register, value: RegExpression, meta: RegMeta
@@ -2167,15 +2237,33 @@ class RegInfo:
         """Assign a value to a register from outside an instruction context."""
         assert self.active_instr is None
         assert key != Register("zero")
-        self.contents[key] = RegData(value, meta)
+        self._set_data(key, RegData(value, meta))
 
     def update_meta(self, key: Register, meta: RegMeta) -> None:
         assert key != Register("zero")
-        self.contents[key] = RegData(self.contents[key].value, meta)
+        self._set_data(key, RegData(self.contents[key].value, meta))
 
     def __delitem__(self, key: Register) -> None:
         assert key != Register("zero")
         del self.contents[key]
+        self._unforced_regs.discard(key)
+        self.call_free_regs.discard(key)
+        self.read_free_regs.discard(key)
+
+    def _set_data(self, key: Register, data: RegData) -> None:
+        old_data = self.contents.get(key)
+        if old_data is None or old_data.value is not data.value:
+            self.call_free_regs.discard(key)
+            self.read_free_regs.discard(key)
+        self.contents[key] = data
+        if isinstance(data.value, EvalOnceExpr) and not data.meta.force:
+            self._unforced_regs.add(key)
+        else:
+            self._unforced_regs.discard(key)
+
+    def unforced_regs(self) -> List[Register]:
+        """Registers holding EvalOnceExpr's that are not yet marked as forced."""
+        return list(self._unforced_regs)
 
     def get_raw(self, key: Register) -> Optional[RegExpression]:
         data = self.contents.get(key)
@@ -2386,7 +2474,7 @@ def deref(
         var = arg
     elif isinstance(arg, AddressMode):
         offset = arg.offset
-        if stack_info.is_stack_reg(arg.rhs):
+        if arg.rhs in stack_info.stack_regs:
             return stack_info.get_stack_var(offset, store=store)
         var = regs[arg.rhs]
     else:
@@ -2446,13 +2534,19 @@ def is_trivial_expression(expr: Expression) -> bool:
     if isinstance(expr, (Literal, GlobalSymbol, SecondF64Half)):
         return True
     if isinstance(expr, AddressOf):
-        return all(is_trivial_expression(e) for e in expr.dependencies())
+        # AddressOf only has a single dependency
+        return is_trivial_expression(expr.expr)
     return False
 
 
 def should_wrap_transparently(expr: Expression) -> bool:
     """Compute whether an EvalOnceExpr should be marked as `transparent = True`,
     thus not using a variable despite multiple uses (unless forced)."""
+    # Check the most common types by identity first, since that is cheaper than
+    # isinstance checks against a tuple of types.
+    expr_type = type(expr)
+    if expr_type is EvalOnceExpr or expr_type is LocalVar or expr_type is Literal:
+        return True
     if isinstance(
         expr,
         (
@@ -2469,7 +2563,13 @@ def should_wrap_transparently(expr: Expression) -> bool:
     ):
         return True
     if isinstance(expr, AddressOf):
-        return all(should_wrap_transparently(e) for e in expr.dependencies())
+        ret = expr._wrap_transparently
+        if ret is None:
+            ret = should_wrap_transparently(expr.expr)
+            # The result for a Cast depends on its (mutable) types, so don't cache it
+            if not isinstance(expr.expr, Cast):
+                object.__setattr__(expr, "_wrap_transparently", ret)
+        return ret
     if isinstance(expr, Cast):
         return expr.should_wrap_transparently()
     return False
@@ -2484,6 +2584,14 @@ def is_type_obvious(expr: Expression) -> bool:
     This function may produce wrong results while code is being generated,
     since at that point we don't know the final status of EvalOnceExpr's.
     """
+    if isinstance(expr, EvalOnceExpr):
+        if expr.uses_var():
+            return True
+        return is_type_obvious(expr.wrapped_expr)
+    # Exact-type fast path for the most frequent leaves, before the tuple check
+    expr_type = type(expr)
+    if expr_type is Literal or expr_type is LocalVar or expr_type is Cast:
+        return True
     if isinstance(
         expr,
         (
@@ -2498,10 +2606,6 @@ def is_type_obvious(expr: Expression) -> bool:
         ),
     ):
         return True
-    if isinstance(expr, EvalOnceExpr):
-        if expr.uses_var():
-            return True
-        return is_type_obvious(expr.wrapped_expr)
     return False
 
 
@@ -2522,7 +2626,11 @@ def simplify_condition(expr: Expression) -> Expression:
     if isinstance(expr, BinaryOp):
         left = simplify_condition(expr.left)
         right = simplify_condition(expr.right)
-        if isinstance(left, BinaryOp) and left.is_comparison() and right == Literal(0):
+        if (
+            isinstance(left, BinaryOp)
+            and left.is_comparison()
+            and right == LITERAL_ZERO
+        ):
             if expr.op == "==":
                 return simplify_condition(left.negated())
             if expr.op == "!=":
@@ -2556,15 +2664,19 @@ def balanced_parentheses(string: str) -> bool:
     Check if parentheses in a string are balanced, ignoring any non-parenthesis
     characters. E.g. true for "(x())yz", false for ")(" or "(".
     """
+    # Jump from one ")" to the next, counting the "("s in between with
+    # str.count, rather than looping over the string one character at a time.
     bal = 0
-    for c in string:
-        if c == "(":
-            bal += 1
-        elif c == ")":
-            if bal == 0:
-                return False
-            bal -= 1
-    return bal == 0
+    pos = 0
+    while True:
+        close = string.find(")", pos)
+        if close == -1:
+            break
+        bal += string.count("(", pos, close) - 1
+        if bal < 0:
+            return False
+        pos = close + 1
+    return bal + string.count("(", pos) == 0
 
 
 def format_expr(expr: Expression, fmt: Formatter) -> str:
@@ -2640,10 +2752,32 @@ def uses_expr(
 ) -> bool:
     if expr_filter(expr) and not isinstance(parent, AddressOf):
         return True
+    return _dependencies_use_expr(expr, expr_filter, {})
+
+
+def _dependencies_use_expr(
+    expr: Expression,
+    expr_filter: Callable[[Expression], bool],
+    cache: Dict[int, bool],
+) -> bool:
+    """Helper for uses_expr, which checks if any (transitive) dependency of
+    `expr` matches `expr_filter`. Expression trees often share subtrees (e.g.
+    through EvalOnceExpr's), so results are memoized by node identity in
+    `cache`, which must not outlive a single top-level call."""
+    key = id(expr)
+    ret = cache.get(key)
+    if ret is not None:
+        return ret
+    ret = False
+    is_address_of = isinstance(expr, AddressOf)
     for e in expr.dependencies():
-        if uses_expr(e, expr_filter, expr):
-            return True
-    return False
+        if (expr_filter(e) and not is_address_of) or _dependencies_use_expr(
+            e, expr_filter, cache
+        ):
+            ret = True
+            break
+    cache[key] = ret
+    return ret
 
 
 def late_unwrap(expr: Expression) -> Expression:
@@ -2681,12 +2815,12 @@ def early_unwrap(expr: Expression) -> Expression:
     This is fine to use even while code is being generated, but disrespects decisions
     to use a temp for a value, so use with care.
     """
-    if (
+    while (
         isinstance(expr, EvalOnceExpr)
         and not expr.forced_emit
         and not expr.emit_exactly_once
     ):
-        return early_unwrap(expr.wrapped_expr)
+        expr = expr.wrapped_expr
     return expr
 
 
@@ -2696,8 +2830,8 @@ def early_unwrap_ints(expr: Expression) -> Expression:
     This is a bit sketchier than early_unwrap(), but can be used for pattern matching.
     """
     uw_expr = early_unwrap(expr)
-    if isinstance(uw_expr, Cast) and uw_expr.reinterpret and uw_expr.type.is_int():
-        return early_unwrap_ints(uw_expr.expr)
+    while isinstance(uw_expr, Cast) and uw_expr.reinterpret and uw_expr.type.is_int():
+        uw_expr = early_unwrap(uw_expr.expr)
     return uw_expr
 
 
@@ -2893,10 +3027,10 @@ def handle_addi_real(
     stack_info: StackInfo,
     args: InstrArgs,
 ) -> Expression:
-    if source_reg is not None and stack_info.is_stack_reg(source_reg):
+    if source_reg in stack_info.stack_regs:
         # Adding to sp, i.e. passing an address.
         assert isinstance(imm, Literal)
-        if stack_info.is_stack_reg(output_reg):
+        if output_reg in stack_info.stack_regs:
             # Changing sp. Just ignore that.
             return source
         # Keep track of all local variables that we take addresses of.
@@ -2912,7 +3046,7 @@ def add_imm(
     output_reg: Register, source: Expression, imm: Expression, args: InstrArgs
 ) -> Expression:
     stack_info = args.stack_info
-    if imm == Literal(0):
+    if imm == LITERAL_ZERO:
         # addiu $reg1, $reg2, 0 is a move
         # (this happens when replacing %lo(...) by 0)
         return source
@@ -2991,9 +3125,9 @@ def handle_load(args: InstrArgs, type: Type) -> Expression:
                 data = ent.data[0][:size]
                 val: int
                 if size == 4:
-                    (val,) = struct.unpack(">I", data)
+                    (val,) = BE_U32.unpack(data)
                 else:
-                    (val,) = struct.unpack(">Q", data)
+                    (val,) = BE_U64.unpack(data)
                 return Literal(value=val, type=type)
 
     return as_type(expr, type, silent=True)
@@ -3013,18 +3147,22 @@ def deref_unaligned(
     return deref(arg, regs, stack_info, size=1, store=store)
 
 
+def unaligned_load_key(
+    ref: Union[AddressMode, RawSymbolRef], regs: RegInfo, offset_adjust: int = 0
+) -> Tuple[int, object]:
+    """Identify the memory location of an lwl/lwr, for pairing them up."""
+    if isinstance(ref, AddressMode):
+        return (ref.offset + offset_adjust, regs[ref.rhs])
+    return (ref.offset + offset_adjust, ref.sym)
+
+
 def handle_lwl(args: InstrArgs) -> Expression:
     # Unaligned load for the left part of a register (lwl can technically merge with
     # a pre-existing lwr, but doesn't in practice, so we treat this as a standard
     # destination-first operation)
     ref = args.memory_ref(1)
     expr = deref_unaligned(ref, args.regs, args.stack_info)
-    key: Tuple[int, object]
-    if isinstance(ref, AddressMode):
-        key = (ref.offset, args.regs[ref.rhs])
-    else:
-        key = (ref.offset, ref.sym)
-    return Lwl(expr, key)
+    return Lwl(expr, unaligned_load_key(ref, args.regs))
 
 
 def handle_lwr(args: InstrArgs) -> Expression:
@@ -3032,11 +3170,7 @@ def handle_lwr(args: InstrArgs) -> Expression:
     # existing lwl, if it loads from the same target but with an offset that's +3.
     uw_old_value = early_unwrap(args.reg(0))
     ref = args.memory_ref(1)
-    lwl_key: Tuple[int, object]
-    if isinstance(ref, AddressMode):
-        lwl_key = (ref.offset - 3, args.regs[ref.rhs])
-    else:
-        lwl_key = (ref.offset - 3, ref.sym)
+    lwl_key = unaligned_load_key(ref, args.regs, -3)
     if isinstance(uw_old_value, Lwl) and uw_old_value.key[0] == lwl_key[0]:
         return UnalignedLoad(uw_old_value.load_expr)
     if ref.offset % 4 == 2:
@@ -3057,7 +3191,7 @@ def make_store(args: InstrArgs, type: Type) -> Optional[StoreStmt]:
     else:
         source_val = args.reg(0)
     target = args.memory_ref(1)
-    is_stack = isinstance(target, AddressMode) and stack_info.is_stack_reg(target.rhs)
+    is_stack = isinstance(target, AddressMode) and target.rhs in stack_info.stack_regs
     if (
         is_stack
         and source_raw is not None
@@ -3143,8 +3277,8 @@ def handle_conditional_move(args: InstrArgs, nonzero: bool) -> Expression:
 
 
 def format_f32_imm(num: int) -> str:
-    packed = struct.pack(">I", num & (2**32 - 1))
-    value = struct.unpack(">f", packed)[0]
+    packed = BE_U32.pack(num & (2**32 - 1))
+    value = BE_F32.unpack(packed)[0]
 
     if not value or value == 4294967296.0:
         # Zero, negative zero, nan, or INT_MAX.
@@ -3177,67 +3311,90 @@ def format_f32_imm(num: int) -> str:
             return "0"
         return ret
 
-    # 20 decimals is more than enough for a float. Start there, then try to shrink it.
-    prec = 20
-    while prec > 0:
-        prec -= 1
-        value2 = float(fmt(prec))
-        if struct.pack(">f", value2) != packed:
-            prec += 1
-            break
+    def round_trips(prec: int) -> bool:
+        return BE_F32.pack(float(fmt(prec))) == packed
 
-    if prec == 20:
+    # 20 decimals is more than enough for a float. Start there, then try to shrink it.
+    if not round_trips(19):
         # Uh oh, even the original value didn't format correctly. Fall back to str(),
         # which ought to work.
         return str(value)
 
-    ret = fmt(prec)
+    # Adding more digits only brings the formatted value closer to the original,
+    # so if a precision round-trips then so do all larger ones. That means we can
+    # binary search for the smallest one, instead of trying every precision.
+    lo, hi = 0, 19
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if round_trips(mid):
+            hi = mid
+        else:
+            lo = mid + 1
+
+    ret = fmt(lo)
     if "." not in ret:
         ret += ".0"
     return ret
 
 
 def format_f64_imm(num: int) -> str:
-    (value,) = struct.unpack(">d", struct.pack(">Q", num & (2**64 - 1)))
+    (value,) = BE_F64.unpack(BE_U64.pack(num & (2**64 - 1)))
     return str(value)
 
 
-def fold_divmod(original_expr: BinaryOp) -> BinaryOp:
-    """
-    Return a new BinaryOp instance if this one can be simplified to a single / or % op.
-    This involves simplifying expressions using MULT_HI, MULTU_HI, +, -, <<, >>, and /.
+# Signature for fold_divmod's rewrite rules. Each rule is passed the BinaryOp being
+# folded, its children unwrapped with `early_unwrap_ints`, and a memoized version of
+# `early_unwrap_ints` for further unwrapping. It returns the folded expression, or
+# None if the rule does not apply.
+DivmodRule = Callable[
+    [BinaryOp, Expression, Expression, Callable[[Expression], Expression]],
+    Optional[BinaryOp],
+]
+
+
+def memoize_unwrap(
+    unwrap_fn: Callable[[Expression], Expression]
+) -> Callable[[Expression], Expression]:
+    """Return a version of early_unwrap/early_unwrap_ints that caches results by
+    node identity. Since EvalOnceExpr's can change state, it should only be used
+    for a short-lived pattern match, like a single call to fold_divmod."""
+    cache: Dict[int, Expression] = {}
+
+    def unwrap(expr: Expression) -> Expression:
+        key = id(expr)
+        ret = cache.get(key)
+        if ret is None:
+            ret = cache[key] = unwrap_fn(expr)
+        return ret
 
-    In GCC 2.7.2, the code that generates these instructions is in expmed.c.
+    return unwrap
 
-    See also https://ridiculousfish.com/blog/posts/labor-of-division-episode-i.html
-    for a modern writeup of a similar algorithm.
 
-    This optimization is also used by MWCC and modern compilers (but not IDO).
-    """
-    mult_high_ops = ("MULT_HI", "MULTU_HI")
-    possible_match_ops = mult_high_ops + ("-", "+", ">>")
+def is_pow2_shift(shift: int, value: int) -> bool:
+    """Check whether `(1 << shift) == value`, without computing the shift."""
+    return value > 0 and value & (value - 1) == 0 and value.bit_length() - 1 == shift
 
-    # Only operate on integer expressions of certain operations
-    if original_expr.is_floating() or original_expr.op not in possible_match_ops:
-        return original_expr
 
-    # Use `early_unwrap_ints` instead of `early_unwrap` to ignore Casts to integer types
-    # Although this discards some extra type information, this function largely ignores
-    # sign/size information to stay simpler. The result will be made with BinaryOp.int()
-    # regardless of input types.
-    expr = original_expr
-    left_expr = early_unwrap_ints(expr.left)
-    right_expr = early_unwrap_ints(expr.right)
-    divisor_shift = 0
+def round_div(x: int, y: int) -> Optional[int]:
+    """Divide `x` by `y`, if the quotient is "close enough" to an integer value.
+    This is used instead of checking for the exact error term of a division."""
+    if y <= 1:
+        return None
+    result = round(x / y)
+    if x / (y + 1) <= result <= x / (y - 1):
+        return result
+    return None
+
 
+def fold_signed_pow2_div(
+    expr: BinaryOp,
+    left_expr: Expression,
+    right_expr: Expression,
+    unwrap: Callable[[Expression], Expression],
+) -> Optional[BinaryOp]:
     # Detect signed power-of-two division: (x >> N) + M2C_CARRY --> x / (1 << N)
-    if (
-        isinstance(left_expr, BinaryOp)
-        and left_expr.op == ">>"
-        and isinstance(left_expr.right, Literal)
-        and expr.op == "+"
-        and isinstance(right_expr, CarryBit)
-    ):
+    assert isinstance(left_expr, BinaryOp)
+    if isinstance(right_expr, CarryBit) and isinstance(left_expr.right, Literal):
         new_denom = 1 << left_expr.right.value
         return BinaryOp.sint(
             left=left_expr.left,
@@ -3245,16 +3402,19 @@ def fold_divmod(original_expr: BinaryOp) -> BinaryOp:
             right=Literal(new_denom),
             silent=True,
         )
+    return None
+
 
+def fold_shifted_div(
+    expr: BinaryOp,
+    left_expr: Expression,
+    right_expr: Expression,
+    unwrap: Callable[[Expression], Expression],
+) -> Optional[BinaryOp]:
     # Fold `/` with `>>`: ((x / N) >> M) --> x / (N << M)
     # NB: If x is signed, this is only correct if there is a sign-correcting subtraction term
-    if (
-        isinstance(left_expr, BinaryOp)
-        and left_expr.op == "/"
-        and isinstance(left_expr.right, Literal)
-        and expr.op == ">>"
-        and isinstance(right_expr, Literal)
-    ):
+    assert isinstance(left_expr, BinaryOp)
+    if isinstance(right_expr, Literal) and isinstance(left_expr.right, Literal):
         new_denom = left_expr.right.value << right_expr.value
         if new_denom < (1 << 32):
             return BinaryOp.int(
@@ -3262,32 +3422,65 @@ def fold_divmod(original_expr: BinaryOp) -> BinaryOp:
                 op="/",
                 right=Literal(new_denom),
             )
+    return None
+
 
+def fold_mod(
+    expr: BinaryOp,
+    left_expr: Expression,
+    right_expr: Expression,
+    unwrap: Callable[[Expression], Expression],
+) -> Optional[BinaryOp]:
     # Detect `%`: (x - ((x / y) * y)) --> x % y
-    if expr.op == "-" and isinstance(right_expr, BinaryOp) and right_expr.op == "*":
-        div_expr = early_unwrap_ints(right_expr.left)
-        mod_base = early_unwrap_ints(right_expr.right)
-        if (
-            isinstance(div_expr, BinaryOp)
-            and early_unwrap_ints(div_expr.left) == left_expr
+    assert isinstance(right_expr, BinaryOp)
+    div_expr = unwrap(right_expr.left)
+    mod_base = unwrap(right_expr.right)
+    if isinstance(div_expr, BinaryOp) and unwrap(div_expr.left) == left_expr:
+        # Accept either `(x / y) * y` or `(x >> N) * M` (where `1 << N == M`)
+        divisor = unwrap(div_expr.right)
+        if (div_expr.op == "/" and divisor == mod_base) or (
+            div_expr.op == ">>"
+            and isinstance(divisor, Literal)
+            and isinstance(mod_base, Literal)
+            and is_pow2_shift(divisor.value, mod_base.value)
         ):
-            # Accept either `(x / y) * y` or `(x >> N) * M` (where `1 << N == M`)
-            divisor = early_unwrap_ints(div_expr.right)
-            if (div_expr.op == "/" and divisor == mod_base) or (
-                div_expr.op == ">>"
-                and isinstance(divisor, Literal)
-                and isinstance(mod_base, Literal)
-                and (1 << divisor.value) == mod_base.value
-            ):
-                return BinaryOp.int(left=left_expr, op="%", right=right_expr.right)
+            return BinaryOp.int(left=left_expr, op="%", right=right_expr.right)
+    return None
+
+
+def fold_div_error_term_add(
+    expr: BinaryOp,
+    left_expr: Expression,
+    right_expr: Expression,
+    unwrap: Callable[[Expression], Expression],
+) -> Optional[BinaryOp]:
+    # Remove outer error term: ((x / N) + ((x / N) >> 31)) --> x / N
+    # As N gets close to (1 << 30), this is no longer a negligible error term
+    assert isinstance(left_expr, BinaryOp) and isinstance(right_expr, BinaryOp)
+    if (
+        left_expr.op == "/"
+        and isinstance(left_expr.right, Literal)
+        and left_expr.right.value <= (1 << 29)
+        and unwrap(right_expr.left) == left_expr
+        and right_expr.op == ">>"
+        and unwrap(right_expr.right) == LITERAL_31
+    ):
+        return left_expr
+    return None
+
+
+def fold_div_error_term_sub(
+    expr: BinaryOp,
+    left_expr: Expression,
+    right_expr: Expression,
+    unwrap: Callable[[Expression], Expression],
+) -> Optional[BinaryOp]:
+    assert isinstance(left_expr, BinaryOp) and isinstance(right_expr, BinaryOp)
 
     # Detect dividing by a negative: ((x >> 31) - (x / N)) --> x / -N
     if (
-        expr.op == "-"
-        and isinstance(left_expr, BinaryOp)
-        and left_expr.op == ">>"
-        and early_unwrap_ints(left_expr.right) == Literal(31)
-        and isinstance(right_expr, BinaryOp)
+        left_expr.op == ">>"
+        and unwrap(left_expr.right) == LITERAL_31
         and right_expr.op == "/"
         and isinstance(right_expr.right, Literal)
     ):
@@ -3297,34 +3490,16 @@ def fold_divmod(original_expr: BinaryOp) -> BinaryOp:
             left_expr,
         )
 
-    # Remove outer error term: ((x / N) + ((x / N) >> 31)) --> x / N
-    # As N gets close to (1 << 30), this is no longer a negligible error term
-    if (
-        expr.op == "+"
-        and isinstance(left_expr, BinaryOp)
-        and left_expr.op == "/"
-        and isinstance(left_expr.right, Literal)
-        and left_expr.right.value <= (1 << 29)
-        and isinstance(right_expr, BinaryOp)
-        and early_unwrap_ints(right_expr.left) == left_expr
-        and right_expr.op == ">>"
-        and early_unwrap_ints(right_expr.right) == Literal(31)
-    ):
-        return left_expr
-
     # Remove outer error term: ((x / N) - (x >> 31)) --> x / N
     if (
-        expr.op == "-"
-        and isinstance(left_expr, BinaryOp)
-        and left_expr.op == "/"
+        left_expr.op == "/"
         and isinstance(left_expr.right, Literal)
-        and isinstance(right_expr, BinaryOp)
         and right_expr.op == ">>"
-        and early_unwrap_ints(right_expr.right) == Literal(31)
+        and unwrap(right_expr.right) == LITERAL_31
     ):
         div_expr = left_expr
-        shift_var_expr = early_unwrap_ints(right_expr.left)
-        div_var_expr = early_unwrap_ints(div_expr.left)
+        shift_var_expr = unwrap(right_expr.left)
+        div_var_expr = unwrap(div_expr.left)
         # Check if the LHS of the shift is the same var that we're dividing by
         if div_var_expr == shift_var_expr:
             if isinstance(div_expr.right, Literal) and div_expr.right.value >= (
@@ -3339,23 +3514,31 @@ def fold_divmod(original_expr: BinaryOp) -> BinaryOp:
         # If the var is under 32 bits, the error term may look like `(x << K) >> 31` instead
         if (
             isinstance(shift_var_expr, BinaryOp)
-            and early_unwrap_ints(div_expr.left)
-            == early_unwrap_ints(shift_var_expr.left)
+            and div_var_expr == unwrap(shift_var_expr.left)
             and shift_var_expr.op == "<<"
             and isinstance(shift_var_expr.right, Literal)
         ):
             return div_expr
+    return None
+
+
+def fold_mult_hi_div(
+    expr: BinaryOp,
+    left_expr: Expression,
+    right_expr: Expression,
+    unwrap: Callable[[Expression], Expression],
+) -> Optional[BinaryOp]:
+    divisor_shift = 0
 
     # Shift on the result of the mul: MULT_HI(x, N) >> M, shift the divisor by M
-    if (
-        isinstance(left_expr, BinaryOp)
-        and expr.op == ">>"
-        and isinstance(right_expr, Literal)
-    ):
+    if expr.op == ">>":
+        assert isinstance(left_expr, BinaryOp)
+        if not isinstance(right_expr, Literal):
+            return None
         divisor_shift += right_expr.value
         expr = left_expr
-        left_expr = early_unwrap_ints(expr.left)
-        right_expr = early_unwrap_ints(expr.right)
+        left_expr = unwrap(expr.left)
+        right_expr = unwrap(expr.right)
         # Normalize MULT_HI(N, x) to MULT_HI(x, N)
         if isinstance(left_expr, Literal) and not isinstance(right_expr, Literal):
             left_expr, right_expr = right_expr, left_expr
@@ -3368,33 +3551,25 @@ def fold_divmod(original_expr: BinaryOp) -> BinaryOp:
             isinstance(left_expr, BinaryOp)
             and left_expr.op == "MULT_HI"
             and expr.op == "+"
-            and early_unwrap_ints(left_expr.left) == right_expr
+            and unwrap(left_expr.left) == right_expr
         ):
             expr = left_expr
-            left_expr = early_unwrap_ints(expr.left)
-            right_expr = early_unwrap_ints(expr.right)
+            left_expr = unwrap(expr.left)
+            right_expr = unwrap(expr.right)
+
+    if expr.op not in MULT_HIGH_OPS:
+        return None
 
     # Shift on the LHS of the mul: MULT_HI(x >> M, N) --> MULT_HI(x, N) >> M
     if (
-        expr.op in mult_high_ops
-        and isinstance(left_expr, BinaryOp)
+        isinstance(left_expr, BinaryOp)
         and left_expr.op == ">>"
         and isinstance(left_expr.right, Literal)
     ):
         divisor_shift += left_expr.right.value
-        left_expr = early_unwrap_ints(left_expr.left)
+        left_expr = unwrap(left_expr.left)
 
-    # Instead of checking for the error term precisely, just check that
-    # the quotient is "close enough" to the integer value
-    def round_div(x: int, y: int) -> Optional[int]:
-        if y <= 1:
-            return None
-        result = round(x / y)
-        if x / (y + 1) <= result <= x / (y - 1):
-            return result
-        return None
-
-    if expr.op in mult_high_ops and isinstance(right_expr, Literal):
+    if isinstance(right_expr, Literal):
         denom = round_div(1 << (32 + divisor_shift), right_expr.value)
         if denom is not None:
             return BinaryOp.int(
@@ -3402,6 +3577,75 @@ def fold_divmod(original_expr: BinaryOp) -> BinaryOp:
                 op="/",
                 right=Literal(denom),
             )
+    return None
+
+
+# Matches any left operand in DIVMOD_RULES, including ones that aren't BinaryOps.
+ANY_OP = "<any>"
+
+# fold_divmod rules, as (op, left op, right op, rule). The left/right ops are those
+# of the unwrapped operands, or None for operands that aren't BinaryOps.
+DIVMOD_RULES: List[Tuple[str, Optional[str], Optional[str], DivmodRule]] = [
+    ("+", ">>", None, fold_signed_pow2_div),
+    ("+", "/", ">>", fold_div_error_term_add),
+    ("-", ANY_OP, "*", fold_mod),
+    ("-", ">>", "/", fold_div_error_term_sub),
+    ("-", "/", ">>", fold_div_error_term_sub),
+    (">>", "/", None, fold_shifted_div),
+    (">>", "+", None, fold_mult_hi_div),
+    (">>", "MULT_HI", None, fold_mult_hi_div),
+    (">>", "MULTU_HI", None, fold_mult_hi_div),
+    ("MULT_HI", ANY_OP, None, fold_mult_hi_div),
+    ("MULTU_HI", ANY_OP, None, fold_mult_hi_div),
+]
+
+
+def bucket_divmod_rules() -> Dict[
+    Tuple[str, Optional[str], Optional[str]], List[DivmodRule]
+]:
+    """Group DIVMOD_RULES by (op, left op, right op), preserving their order."""
+    ret: Dict[Tuple[str, Optional[str], Optional[str]], List[DivmodRule]] = {}
+    for op, left_op, right_op, rule in DIVMOD_RULES:
+        ret.setdefault((op, left_op, right_op), []).append(rule)
+    return ret
+
+
+# Rules for an exact left op are tried before ANY_OP rules.
+FOLD_DIVMOD_RULES = bucket_divmod_rules()
+
+
+def fold_divmod(original_expr: BinaryOp) -> BinaryOp:
+    """
+    Return a new BinaryOp instance if this one can be simplified to a single / or % op.
+    This involves simplifying expressions using MULT_HI, MULTU_HI, +, -, <<, >>, and /.
+
+    In GCC 2.7.2, the code that generates these instructions is in expmed.c.
+
+    See also https://ridiculousfish.com/blog/posts/labor-of-division-episode-i.html
+    for a modern writeup of a similar algorithm.
+
+    This optimization is also used by MWCC and modern compilers (but not IDO).
+    """
+    # Only operate on integer expressions of certain operations
+    if original_expr.is_floating() or original_expr.op not in DIVMOD_MATCH_OPS:
+        return original_expr
+
+    # Use `early_unwrap_ints` instead of `early_unwrap` to ignore Casts to integer types
+    # Although this discards some extra type information, this function largely ignores
+    # sign/size information to stay simpler. The result will be made with BinaryOp.int()
+    # regardless of input types.
+    unwrap = memoize_unwrap(early_unwrap_ints)
+    left_expr = unwrap(original_expr.left)
+    right_expr = unwrap(original_expr.right)
+
+    op = original_expr.op
+    left_op = left_expr.op if isinstance(left_expr, BinaryOp) else None
+    right_op = right_expr.op if isinstance(right_expr, BinaryOp) else None
+    for key in ((op, left_op, right_op), (op, ANY_OP, right_op)):
+        for rule in FOLD_DIVMOD_RULES.get(key, ()):
+            folded = rule(original_expr, left_expr, right_expr, unwrap)
+            if folded is not None:
+                return folded
 
     return original_expr
 
@@ -3441,23 +3685,40 @@ def replace_clz_shift(expr: BinaryOp) -> BinaryOp:
 def replace_bitand(expr: BinaryOp) -> Expression:
     """Detect expressions using `&` for truncating integer casts"""
     if not expr.is_floating() and expr.op == "&":
-        if expr.right == Literal(0xFF):
+        if expr.right == LITERAL_FF:
             return as_type(expr.left, Type.int_of_size(8), silent=False)
-        if expr.right == Literal(0xFFFF):
+        if expr.right == LITERAL_FFFF:
             return as_type(expr.left, Type.int_of_size(16), silent=False)
     return expr
 
 
-def fold_mul_chains(expr: Expression) -> Expression:
+def fold_mul_chains(
+    expr: Expression, unwrap: Optional[Callable[[Expression], Expression]] = None
+) -> Expression:
     """Simplify an expression involving +, -, * and << to a single multiplication,
     e.g. 4*x - x -> 3*x, or x<<2 -> x*4. This includes some logic for preventing
     folds of consecutive sll, and keeping multiplications by large powers of two
-    as bitshifts at the top layer."""
+    as bitshifts at the top layer.
+
+    `unwrap` can be a memoized early_unwrap shared with other pattern matches on
+    the same expression; see memoize_unwrap."""
+    cached_unwrap = unwrap if unwrap is not None else memoize_unwrap(early_unwrap)
+    cache: Dict[Tuple[int, bool, bool], Tuple[Expression, int]] = {}
 
     def fold(
         expr: Expression, toplevel: bool, allow_sll: bool
     ) -> Tuple[Expression, int]:
-        if isinstance(expr, BinaryOp):
+        # Subtrees can be shared (e.g. through EvalOnceExpr's), so memoize by identity
+        key = (id(expr), toplevel, allow_sll)
+        ret = cache.get(key)
+        if ret is None:
+            ret = cache[key] = fold_uncached(expr, toplevel, allow_sll)
+        return ret
+
+    def fold_uncached(
+        expr: Expression, toplevel: bool, allow_sll: bool
+    ) -> Tuple[Expression, int]:
+        if type(expr) is BinaryOp:
             lbase, lnum = fold(expr.left, False, (expr.op != "<<"))
             rbase, rnum = fold(expr.right, False, (expr.op != "<<"))
             if expr.op == "<<" and isinstance(expr.right, Literal) and allow_sll:
@@ -3472,15 +3733,16 @@ def fold_mul_chains(expr: Expression) -> Expression:
                 and (allow_sll or expr.right.value % 2 != 0)
             ):
                 return (lbase, lnum * expr.right.value)
-            if early_unwrap(lbase) == early_unwrap(rbase):
+            if cached_unwrap(lbase) == cached_unwrap(rbase):
                 if expr.op == "+":
                     return (lbase, lnum + rnum)
                 if expr.op == "-":
                     return (lbase, lnum - rnum)
-        if isinstance(expr, UnaryOp) and expr.op == "-" and not toplevel:
-            base, num = fold(expr.expr, False, True)
-            return (base, -num)
-        uw_expr = early_unwrap(expr)
+        elif type(expr) is UnaryOp:
+            if expr.op == "-" and not toplevel:
+                base, num = fold(expr.expr, False, True)
+                return (base, -num)
+        uw_expr = cached_unwrap(expr)
         if uw_expr is not expr:
             base, num = fold(uw_expr, False, allow_sll)
             if num != 1:
@@ -3500,8 +3762,9 @@ def array_access_from_add(
     *,
     target_size: Optional[int],
     ptr: bool,
+    unwrap: Callable[[Expression], Expression] = early_unwrap,
 ) -> Optional[Expression]:
-    expr = early_unwrap(expr)
+    expr = unwrap(expr)
     if not isinstance(expr, BinaryOp) or expr.op != "+":
         return None
     base = expr.left
@@ -3511,7 +3774,7 @@ def array_access_from_add(
 
     index = addend
     scale = 1
-    uw_addend = early_unwrap(addend)
+    uw_addend = unwrap(addend)
     if (
         isinstance(uw_addend, BinaryOp)
         and uw_addend.op in ("*", "<<")
@@ -3530,7 +3793,7 @@ def array_access_from_add(
     if target_type is None:
         return None
 
-    uw_base = early_unwrap(base)
+    uw_base = unwrap(base)
     typepool = stack_info.global_info.typepool
 
     # In `&x + index * scale`, if the type of `x` is not known, try to mark it as an array.
@@ -3605,12 +3868,11 @@ def array_access_from_add(
     ret: Expression = ArrayAccess(base, index, type=target_type)
 
     # Add .field if necessary by wrapping ret in StructAccess(AddressOf(...))
-    ret_ref = AddressOf(ret, type=ret.type.reference())
-    field_path, field_type, _ = ret_ref.type.get_deref_field(
-        offset, target_size=target_size
-    )
-
     if offset != 0 or (target_size is not None and target_size != scale):
+        ret_ref = AddressOf(ret, type=ret.type.reference())
+        field_path, field_type, _ = ret_ref.type.get_deref_field(
+            offset, target_size=target_size
+        )
         ret = StructAccess(
             struct_var=ret_ref,
             offset=offset,
@@ -3650,12 +3912,27 @@ def handle_add(args: InstrArgs) -> Expression:
         )
 
     expr = BinaryOp(left=as_intptr(lhs), op="+", right=as_intptr(rhs), type=type)
-    folded_expr = fold_mul_chains(expr)
+    # The pattern matches below share a single early_unwrap cache.
+    unwrap = memoize_unwrap(early_unwrap)
+    # fold_mul_chains can only do something if one of the operands is itself an
+    # arithmetic expression, or if both are the same (x + x --> x * 2).
+    uw_left = unwrap(expr.left)
+    uw_right = unwrap(expr.right)
+    if (
+        isinstance(uw_left, (BinaryOp, UnaryOp))
+        or isinstance(uw_right, (BinaryOp, UnaryOp))
+        or uw_left == uw_right
+    ):
+        folded_expr = fold_mul_chains(expr, unwrap)
+    else:
+        folded_expr = expr
     if isinstance(folded_expr, BinaryOp):
         folded_expr = fold_divmod(folded_expr)
     if folded_expr is not expr:
         return folded_expr
-    array_expr = array_access_from_add(expr, 0, stack_info, target_size=None, ptr=True)
+    array_expr = array_access_from_add(
+        expr, 0, stack_info, target_size=None, ptr=True, unwrap=unwrap
+    )
     if array_expr is not None:
         return array_expr
     return expr
@@ -3689,21 +3966,50 @@ def handle_bgez(args: InstrArgs) -> Condition:
     return BinaryOp.scmp(expr, ">=", Literal(0))
 
 
-def rlwi_mask(mask_begin: int, mask_end: int) -> int:
+# RLWI_BITS_UPTO[m] has all bits set from bit m up to the LSB (bit 31)
+RLWI_BITS_UPTO: Tuple[int, ...] = tuple((1 << (32 - m)) - 1 for m in range(33))
+
+
+def compute_rlwi_mask(mask_begin: int, mask_end: int) -> int:
     # Compute the mask constant used by the rlwi* family of PPC instructions,
     # referred to as the `MASK(MB, ME)` function in the processor manual.
     # Bit 0 is the MSB, Bit 31 is the LSB
-    bits_upto: Callable[[int], int] = lambda m: (1 << (32 - m)) - 1
     all_ones = 0xFFFFFFFF
     if mask_begin <= mask_end:
         # Set bits inside the range, fully inclusive
-        mask = bits_upto(mask_begin) - bits_upto(mask_end + 1)
+        mask = RLWI_BITS_UPTO[mask_begin] - RLWI_BITS_UPTO[mask_end + 1]
     else:
         # Set bits from [31, mask_end] and [mask_begin, 0]
-        mask = (bits_upto(mask_end + 1) - bits_upto(mask_begin)) ^ all_ones
+        mask = (RLWI_BITS_UPTO[mask_end + 1] - RLWI_BITS_UPTO[mask_begin]) ^ all_ones
     return mask
 
 
+# All 32 * 32 possible rlwi* masks, indexed by (MB, ME)
+RLWI_MASKS: Dict[Tuple[int, int], int] = {
+    (mb, me): compute_rlwi_mask(mb, me) for mb in range(32) for me in range(32)
+}
+
+
+def rlwi_mask(mask_begin: int, mask_end: int) -> int:
+    mask = RLWI_MASKS.get((mask_begin, mask_end))
+    if mask is None:
+        raise DecompFailure(
+            f"Invalid rlwi* mask bounds: MB={mask_begin}, ME={mask_end}"
+        )
+    return mask
+
+
+def rlwinm_masks(shift: int, mask_begin: int, mask_end: int) -> Tuple[int, int, int]:
+    """Compute (mask, left_mask, right_mask) for handle_rlwinm. left_mask and
+    right_mask are the parts of the mask covering the bits from `source << shift`
+    and `source >> (32 - shift)` respectively."""
+    all_ones = 0xFFFFFFFF
+    mask = rlwi_mask(mask_begin, mask_end)
+    left_mask = (all_ones << shift) & mask
+    right_mask = (all_ones >> (32 - shift)) & mask
+    return mask, left_mask, right_mask
+
+
 def handle_rlwinm(
     source: Expression,
     shift: int,
@@ -3717,11 +4023,9 @@ def handle_rlwinm(
     # ((source << shift) & mask) | ((source >> (32 - shift)) & mask)
     # and compute both OR operands (upper_bits and lower_bits respectively).
     all_ones = 0xFFFFFFFF
-    mask = rlwi_mask(mask_begin, mask_end)
+    mask, left_mask, right_mask = rlwinm_masks(shift, mask_begin, mask_end)
     left_shift = shift
     right_shift = 32 - shift
-    left_mask = (all_ones << left_shift) & mask
-    right_mask = (all_ones >> right_shift) & mask
 
     # We only simplify if the `simplify` argument is True, and there will be no `|` in the
     # resulting expression. If there is an `|`, the expression is best left as bitwise math
@@ -3741,8 +4045,11 @@ def handle_rlwinm(
             upper_bits = BinaryOp.int(
                 left=upper_bits, op="<<", right=Literal(left_shift)
             )
-
-        if simplify:
+            if simplify:
+                upper_bits = fold_mul_chains(upper_bits)
+        elif simplify and isinstance(early_unwrap(source), (BinaryOp, UnaryOp)):
+            # Without a shift, there is only something to fold if the source
+            # itself is arithmetic
             upper_bits = fold_mul_chains(upper_bits)
 
         if left_mask != (all_ones << left_shift) & all_ones:
@@ -3789,7 +4096,7 @@ def handle_rlwimi(
     mask_literal = Literal(rlwi_mask(mask_begin, mask_end))
     mask = UnaryOp("~", mask_literal, type=Type.u32())
     masked_base = BinaryOp.int(left=base, op="&", right=mask)
-    if source == Literal(0):
+    if source == LITERAL_ZERO:
         # If the source is 0, there are no bits inserted. (This may look like `x &= ~0x10`)
         return masked_base
     # Set `simplify=False` to keep the `inserted` expression as bitwise math instead of `*` or `/`
@@ -3811,17 +4118,23 @@ def handle_loadx(args: InstrArgs, type: Type) -> Expression:
     return as_type(expr, type, silent=True)
 
 
+SDA_MACROS: FrozenSet[str] = frozenset({"sda2", "sda21"})
+LO_MACROS: FrozenSet[str] = frozenset({"lo", "l"})
+
+
 def strip_macros(arg: Argument) -> Argument:
     """Replace %lo(...) by 0, and assert that there are no %hi(...). We assume that
     %hi's only ever occur in lui, where we expand them to an entire value, and not
     just the upper part. This preserves semantics in most cases (though not when %hi's
     are reused for different %lo's...)"""
-    if isinstance(arg, Macro):
-        if arg.macro_name in ["sda2", "sda21"]:
+    # Most arguments are plain registers or literals, so check the exact type
+    # rather than doing isinstance checks.
+    if type(arg) is Macro:
+        if arg.macro_name in SDA_MACROS:
             return arg.argument
         if arg.macro_name == "hi":
             raise DecompFailure("%hi macro outside of lui")
-        if arg.macro_name not in ["lo", "l"]:
+        if arg.macro_name not in LO_MACROS:
             raise DecompFailure(f"Unrecognized linker macro %{arg.macro_name}")
         # This is sort of weird; for `symbol@l` we return 0 here and assume
         # that this @l is always perfectly paired with one other @ha.
@@ -3831,10 +4144,12 @@ def strip_macros(arg: Argument) -> Argument:
         if isinstance(arg.argument, AsmLiteral):
             return AsmLiteral(arg.argument.value)
         return AsmLiteral(0)
-    elif isinstance(arg, AsmAddressMode) and isinstance(arg.lhs, Macro):
-        if arg.lhs.macro_name in ["sda2", "sda21"]:
+    elif type(arg) is AsmAddressMode:
+        if not isinstance(arg.lhs, Macro):
+            return arg
+        if arg.lhs.macro_name in SDA_MACROS:
             return arg.lhs.argument
-        if arg.lhs.macro_name not in ["lo", "l"]:
+        if arg.lhs.macro_name not in LO_MACROS:
             raise DecompFailure(
                 f"Bad linker macro in instruction argument {arg}, expected %lo"
             )
@@ -3854,28 +4169,22 @@ class AbiArgSlot:
 
 @dataclass
 class Abi:
+    __slots__ = ("arg_slots", "possible_slots")
     arg_slots: List[AbiArgSlot]
     possible_slots: List[AbiArgSlot]
 
 
-def vars_clobbered_until_dominator(stack_info: StackInfo, node: Node) -> Set[Var]:
-    assert node.immediate_dominator is not None
-
-    seen = {node.immediate_dominator}
-    stack = node.parents[:]
+def vars_clobbered_until_dominator(
+    stack_info: StackInfo, node: Node, nodes: Optional[List[Node]] = None
+) -> Set[Var]:
+    if nodes is None:
+        nodes = nodes_until_dominator(node)
     clobbered = set()
-    while stack:
-        n = stack.pop()
-        if n in seen:
-            continue
-        seen.add(n)
-        for instr in n.block.instructions:
-            for loc in instr.outputs:
-                if isinstance(loc, Register):
-                    var = stack_info.get_planned_var(loc, instr)
-                    if var is not None:
-                        clobbered.add(var)
-        stack.extend(n.parents)
+    for n in nodes:
+        for reg, instr in n.block.register_writes():
+            var = stack_info.get_planned_var(reg, instr)
+            if var is not None:
+                clobbered.add(var)
     return clobbered
 
 
@@ -3892,15 +4201,14 @@ def reg_sources(node: Node, reg: Register) -> Tuple[List[InstructionSource], boo
         if n in seen:
             continue
         seen.add(n)
-        clobbered: Optional[bool] = None
-        for instr in reversed(list(n.block.instructions)):
-            if reg in instr.outputs:
-                sources.append(instr)
-                break
-            elif reg in instr.clobbers:
-                return [], False
-        else:
+        last_writes = n.block.last_writes()
+        if reg not in last_writes:
             stack.extend(n.parents)
+            continue
+        writer = last_writes[reg]
+        if writer is None:
+            return [], False
+        sources.append(writer)
     return sources, uses_dominator
 
 
@@ -3921,8 +4229,15 @@ def assign_naive_phis(
         assert len(phi.sources) >= 2
         assert len(phi.node.parents) >= 2
 
-        # Group parent nodes by the value of their phi register
+        # Group parent nodes by the value of their phi register, and at the same
+        # time check whether all the values are the same after early_unwrap.
         equivalent_nodes: DefaultDict[Expression, List[Node]] = defaultdict(list)
+        first_uw: Optional[Expression] = None
+        all_same = True
+        # Hashing an expression walks the whole tree, so avoid looking up the
+        # same key again when consecutive sources have identical values.
+        last_key: Optional[Expression] = None
+        group: List[Node] = []
         for source in phi.sources:
             if source is None:
                 # Use the end of the first block instead of the start of the
@@ -3933,11 +4248,21 @@ def assign_naive_phis(
                 node = instr_nodes[source]
             expr = get_block_info(node).final_register_states[phi.reg]
             expr.type.unify(phi.type)
-            equivalent_nodes[transparent_unwrap(expr)].append(node)
+            key = transparent_unwrap(expr)
+            if key is not last_key:
+                last_key = key
+                group = equivalent_nodes[key]
+                if not group:
+                    uw = early_unwrap(key)
+                    if first_uw is None:
+                        first_uw = uw
+                    elif all_same and uw != first_uw:
+                        all_same = False
+            group.append(node)
 
         exprs = list(equivalent_nodes.keys())
-        first_uw = early_unwrap(exprs[0])
-        if all(early_unwrap(e) == first_uw for e in exprs[1:]):
+        assert first_uw is not None
+        if all_same:
             # All the phis have the same value (e.g. because we recomputed an
             # expression after a store, or restored a register after a function
             # call). Just use that value instead of introducing a phi node.
@@ -4002,36 +4327,49 @@ def assign_naive_phis(
                 stack_info.get_persistent_planned_var(phi.reg, source).join(var)
 
 
-def propagate_register_meta(nodes: List[Node], reg: Register) -> None:
-    """Propagate RegMeta bits forwards/backwards."""
-    non_terminal: List[Node] = [n for n in nodes if not isinstance(n, TerminalNode)]
+def propagate_register_meta(final_states: Dict[Node, RegInfo], reg: Register) -> None:
+    """Propagate RegMeta bits forwards/backwards. `final_states` contains the
+    final register states of all non-terminal nodes."""
+    non_terminal: List[Node] = list(final_states)
+
+    # Look up each node's RegMeta once, and the RegMeta's of its parents (which
+    # are never terminal nodes).
+    metas: Dict[Node, Optional[RegMeta]] = {
+        n: states.get_meta(reg) for n, states in final_states.items()
+    }
+    parent_metas: Dict[Node, List[RegMeta]] = {}
+    for n in non_terminal:
+        parent_metas[n] = [m for m in (metas[p] for p in n.parents) if m]
 
     # Set `is_read` based on `read_inherited`.
     for n in non_terminal:
-        if reg in get_block_info(n).final_register_states.read_inherited:
-            for p in n.parents:
-                par_meta = get_block_info(p).final_register_states.get_meta(reg)
-                if par_meta:
-                    par_meta.is_read = True
+        if reg in final_states[n].read_inherited:
+            for parent_meta in parent_metas[n]:
+                parent_meta.is_read = True
 
-    # Propagate `is_read` backwards.
+    # Propagate `is_read` backwards. Nodes that are already queued aren't added
+    # to `todo` again, since they will see the updated state once popped.
     todo = non_terminal[:]
+    in_todo = set(todo)
     while todo:
         n = todo.pop()
-        meta = get_block_info(n).final_register_states.get_meta(reg)
+        in_todo.discard(n)
+        meta = metas[n]
+        if not (meta and meta.inherited and meta.is_read):
+            continue
         for p in n.parents:
-            par_meta = get_block_info(p).final_register_states.get_meta(reg)
-            if (par_meta and not par_meta.is_read) and (
-                meta and meta.inherited and meta.is_read
-            ):
+            par_meta = metas[p]
+            if par_meta and not par_meta.is_read:
                 par_meta.is_read = True
-                todo.append(p)
+                if p not in in_todo:
+                    in_todo.add(p)
+                    todo.append(p)
 
     # Set `uninteresting` and propagate it, `function_return`, and `in_pattern` forwards.
     # Start by assuming inherited values are all set; they will get unset iteratively,
     # but for cyclic dependency purposes we want to assume them set.
     for n in non_terminal:
-        meta = get_block_info(n).final_register_states.get_meta(reg)
+        meta = metas[n]
         if meta:
             if meta.inherited:
                 meta.uninteresting = True
@@ -4042,32 +4380,40 @@ def propagate_register_meta(nodes: List[Node], reg: Register) -> None:
                     meta.is_read or meta.function_return or meta.in_pattern
                 )
 
-    todo = non_terminal[:]
+    # Nodes are in program order, which for the most part is a topological order
+    # of the CFG. The backwards pass above pops nodes in reverse program order;
+    # here, reverse the worklist so that nodes are popped in program order, and
+    # acyclic regions are handled in a single sweep without revisits.
+    todo = non_terminal[::-1]
+    in_todo = set(todo)
     while todo:
         n = todo.pop()
-        if isinstance(n, TerminalNode):
-            continue
-        meta = get_block_info(n).final_register_states.get_meta(reg)
+        in_todo.discard(n)
+        meta = metas[n]
         if not meta or not meta.inherited:
             continue
         all_uninteresting = True
         all_function_return = True
         all_in_pattern = True
-        for p in n.parents:
-            par_meta = get_block_info(p).final_register_states.get_meta(reg)
-            if par_meta:
-                all_uninteresting &= par_meta.uninteresting
-                all_function_return &= par_meta.function_return
-                all_in_pattern &= par_meta.in_pattern
+        for parent_meta in parent_metas[n]:
+            all_uninteresting &= parent_meta.uninteresting
+            all_function_return &= parent_meta.function_return
+            all_in_pattern &= parent_meta.in_pattern
+        changed = False
         if meta.uninteresting and not all_uninteresting and not meta.is_read:
             meta.uninteresting = False
-            todo.extend(n.children())
+            changed = True
         if meta.function_return and not all_function_return:
             meta.function_return = False
-            todo.extend(n.children())
+            changed = True
         if meta.in_pattern and not all_in_pattern:
             meta.in_pattern = False
-            todo.extend(n.children())
+            changed = True
+        if changed:
+            for c in n.children():
+                if c not in in_todo and not isinstance(c, TerminalNode):
+                    in_todo.add(c)
+                    todo.append(c)
 
 
 def determine_return_register(
@@ -4094,8 +4440,12 @@ def determine_return_register(
     best_reg: Optional[Register] = None
     best_prio = -1
     for reg in arch.base_return_regs:
-        prios = [priority(b, reg) for b in return_blocks]
-        max_prio = max(prios)
+        max_prio = -1
+        for b in return_blocks:
+            max_prio = max(max_prio, priority(b, reg))
+            if max_prio == 4:
+                # Highest possible priority, no need to look further
+                break
         if max_prio == 4:
             # Register is not always set, skip it
             continue
@@ -4176,9 +4526,9 @@ class NodeState:
             trivial=trivial,
             transparent=transparent,
         )
-        stmt = EvalOnceStmt(expr)
-        self.write_statement(stmt)
-        var.debug_exprs.append(expr)
+        self.write_statement(EvalOnceStmt(expr))
+        if self.stack_info.keep_debug_exprs:
+            var.debug_exprs.append(expr)
 
         if planned_var is not None:
             # Count the pre-planned var assignment as a use. (We could make
@@ -4191,19 +4541,28 @@ class NodeState:
 
         return expr
 
-    def _prevent_later_uses(self, expr_filter: Callable[[Expression], bool]) -> None:
+    def _prevent_later_uses(
+        self,
+        expr_filter: Callable[[Expression], bool],
+        known_misses: Optional[Set[Register]] = None,
+    ) -> None:
         """Prevent later uses of registers that recursively contain something that
-        matches a callback filter."""
-        for r, data in self.regs.contents.items():
-            expr = data.value
-            if isinstance(expr, (PlannedPhiExpr, NaivePhiExpr)):
+        matches a callback filter. If given, `known_misses` is a set of registers
+        known not to match, which gets updated with new non-matching registers."""
+        # Register values commonly share subexpressions, so share the memoization
+        # across all registers. Only register metadata is changed in the loop, so
+        # the expressions' dependencies stay fixed while the cache is alive.
+        cache: Dict[int, bool] = {}
+        for r in self.regs.unforced_regs():
+            if known_misses is not None and r in known_misses:
                 continue
-            if not data.meta.force and uses_expr(expr, expr_filter):
+            data = self.regs.contents[r]
+            expr = data.value
+            if expr_filter(expr) or _dependencies_use_expr(expr, expr_filter, cache):
                 # Mark the register as "if used, emit the expression's once var".
-                if not isinstance(expr, EvalOnceExpr):
-                    static_assert_unreachable(expr)
-
                 self.regs.update_meta(r, replace(data.meta, force=True))
+            elif known_misses is not None:
+                known_misses.add(r)
 
     def prevent_later_value_uses(self, sub_expr: Expression) -> None:
         """Prevent later uses of registers that recursively contain a given
@@ -4215,11 +4574,16 @@ class NodeState:
 
     def prevent_later_function_calls(self) -> None:
         """Prevent later uses of registers that recursively contain a function call."""
-        self._prevent_later_uses(lambda e: isinstance(e, FuncCall))
+        self._prevent_later_uses(
+            lambda e: isinstance(e, FuncCall), self.regs.call_free_regs
+        )
 
     def prevent_later_reads(self) -> None:
         """Prevent later uses of registers that recursively contain a read."""
-        self._prevent_later_uses(lambda e: isinstance(e, (StructAccess, ArrayAccess)))
+        self._prevent_later_uses(
+            lambda e: isinstance(e, (StructAccess, ArrayAccess)),
+            self.regs.read_free_regs,
+        )
 
     def set_initial_reg(self, reg: Register, expr: Expression, meta: RegMeta) -> None:
         assert self.regs.active_instr is None
@@ -4311,11 +4675,17 @@ class NodeState:
         # Clear the `local_var_writes` dict if any of the `func_args` contain
         # a reference to a stack var. (The called function may modify the stack,
         # replacing the value we have in `local_var_writes`.)
+        if not self.local_var_writes:
+            return
+
+        def is_local_var_address(expr: Expression) -> bool:
+            return isinstance(expr, AddressOf) and isinstance(expr.expr, LocalVar)
+
+        # Arguments often share subexpressions, so share the memoization.
+        cache: Dict[int, bool] = {}
         for arg in func_args:
-            if uses_expr(
-                arg,
-                lambda expr: isinstance(expr, AddressOf)
-                and isinstance(expr.expr, LocalVar),
+            if is_local_var_address(arg) or _dependencies_use_expr(
+                arg, is_local_var_address, cache
             ):
                 self.local_var_writes.clear()
                 return
@@ -4382,29 +4752,36 @@ class NodeState:
         fn_sig = fn_target.type.get_function_pointer_signature()
         assert fn_sig is not None, "known function pointers must have a signature"
 
-        likely_regs: Dict[Register, bool] = {}
-        for reg, data in self.regs.contents.items():
-            # We use a much stricter filter for PPC than MIPS, because the same
-            # registers can be used arguments & return values.
-            # The ABI can also mix & match the rN & fN registers, which  makes the
-            # "require" heuristic less powerful.
-            #
-            # - `meta.inherited` will only be False for registers set in *this* basic block
-            # - `meta.function_return` will only be accurate for registers set within this
-            #   basic block because we have not called `propagate_register_meta` yet.
-            #   Within this block, it will be True for registers that were return values.
-            if arch.arch == Target.ArchEnum.PPC and (
-                data.meta.inherited or data.meta.function_return
-            ):
-                likely_regs[reg] = False
-            elif data.meta.in_pattern:
-                # Like `meta.function_return` mentioned above, `meta.in_pattern` will only be
-                # accurate for registers set within this basic block.
-                likely_regs[reg] = False
-            elif data.meta.initial:
-                likely_regs[reg] = False
-            else:
-                likely_regs[reg] = True
+        # Registers are unlikely to be arguments if they are `meta.in_pattern` or
+        # `meta.initial`. Like `meta.function_return` mentioned below,
+        # `meta.in_pattern` will only be accurate for registers set within this
+        # basic block.
+        #
+        # We use a much stricter filter for PPC than MIPS, because the same
+        # registers can be used arguments & return values.
+        # The ABI can also mix & match the rN & fN registers, which  makes the
+        # "require" heuristic less powerful.
+        #
+        # - `meta.inherited` will only be False for registers set in *this* basic block
+        # - `meta.function_return` will only be accurate for registers set within this
+        #   basic block because we have not called `propagate_register_meta` yet.
+        #   Within this block, it will be True for registers that were return values.
+        likely_regs: Dict[Register, bool]
+        if arch.arch == Target.ArchEnum.PPC:
+            likely_regs = {
+                reg: not (
+                    data.meta.inherited
+                    or data.meta.function_return
+                    or data.meta.in_pattern
+                    or data.meta.initial
+                )
+                for reg, data in self.regs.contents.items()
+            }
+        else:
+            likely_regs = {
+                reg: not (data.meta.in_pattern or data.meta.initial)
+                for reg, data in self.regs.contents.items()
+            }
 
         abi = arch.function_abi(fn_sig, likely_regs, for_call=True)
 
@@ -4427,11 +4804,17 @@ class NodeState:
         # Add the arguments after a3.
         # TODO: limit this based on abi.arg_slots. If the function type is known
         # and not variadic, this list should be empty.
-        for _, arg in sorted(self.subroutine_args.items()):
-            if fn_sig.params_known and not fn_sig.is_variadic:
-                func_args.append(CommentExpr.wrap(arg, prefix="extra?"))
-            else:
-                func_args.append(arg)
+        # Usually all stack arguments have been consumed by arg slots above.
+        # Otherwise they are almost always stored in increasing offset order,
+        # which sorting of the int keys handles in linear time.
+        if self.subroutine_args:
+            comment_extra_args = fn_sig.params_known and not fn_sig.is_variadic
+            for offset in sorted(self.subroutine_args):
+                arg = self.subroutine_args[offset]
+                if comment_extra_args:
+                    func_args.append(CommentExpr.wrap(arg, prefix="extra?"))
+                else:
+                    func_args.append(arg)
 
         if not fn_sig.params_known:
             while len(func_args) > len(fn_sig.params):
@@ -4484,44 +4867,48 @@ class NodeState:
 
         self.has_function_call = True
 
-    @contextmanager
-    def current_instr(self, instr: Instruction) -> Iterator[None]:
-        assert self.regs.active_instr is None
-        self.regs.active_instr = instr
-        self.in_pattern = instr.in_pattern
-        try:
-            with current_instr(instr):
-                yield
-        finally:
-            self.regs.active_instr = None
-            self.in_pattern = False
-
-
-def evaluate_instruction(instr: Instruction, state: NodeState) -> None:
-    # Check that instr's attributes are consistent
-    if instr.is_return:
-        assert isinstance(state.node, ReturnNode)
-    if instr.is_conditional:
-        assert state.branch_condition is None and state.switch_control is None
-
-    if instr.eval_fn is not None:
-        args = InstrArgs(instr, instr.args, state.regs, state.stack_info)
-        eval_fn = typing.cast(Callable[[NodeState, InstrArgs], object], instr.eval_fn)
-        eval_fn(state, args)
-
-    # Check that conditional instructions set at least one of branch_condition or switch_control
-    if instr.is_conditional:
-        assert state.branch_condition is not None or state.switch_control is not None
-
 
 def translate_node_body(state: NodeState) -> BlockInfo:
     """
     Given a node and current register contents, return a BlockInfo containing
     the translated AST for that node.
     """
+    # This loop runs once per instruction, so attribute lookups are hoisted, and
+    # instruction evaluation is done inline rather than through (generator-based)
+    # context managers. Errors are wrapped like in `instruction.current_instr`.
+    regs = state.regs
+    stack_info = state.stack_info
+    is_return_node = isinstance(state.node, ReturnNode)
     for instr in state.node.block.instructions:
-        with state.current_instr(instr):
-            evaluate_instruction(instr, state)
+        assert regs.active_instr is None
+        regs.active_instr = instr
+        state.in_pattern = instr.in_pattern
+        try:
+            # Check that instr's attributes are consistent
+            if instr.is_return:
+                assert is_return_node
+            if instr.is_conditional:
+                assert state.branch_condition is None and state.switch_control is None
+
+            if instr.eval_fn is not None:
+                args = InstrArgs(instr, instr.args, regs, stack_info)
+                eval_fn = typing.cast(
+                    Callable[[NodeState, InstrArgs], object], instr.eval_fn
+                )
+                eval_fn(state, args)
+
+            # Check that conditional instructions set at least one of
+            # branch_condition or switch_control
+            if instr.is_conditional:
+                assert (
+                    state.branch_condition is not None
+                    or state.switch_control is not None
+                )
+        except Exception as e:
+            raise InstrProcessingFailure(instr) from e
+        finally:
+            regs.active_instr = None
+            state.in_pattern = False
 
     if state.branch_condition is not None:
         state.branch_condition.use()
@@ -4549,50 +4936,54 @@ def translate_block(
     given node.
     """
 
-    node = state.node
     if options.debug:
-        print(f"\nNode in question: {node}")
+        print(f"\nNode in question: {state.node}")
 
     # Translate the given node and discover final register states.
     try:
         block_info = translate_node_body(state)
-        if options.debug:
-            print(block_info)
     except Exception as e:  # TODO: handle issues better
         if options.stop_on_error:
             raise
+        return translate_block_error(state, e)
 
-        instr: Optional[Instruction] = None
-        if isinstance(e, InstrProcessingFailure) and isinstance(e.__cause__, Exception):
-            instr = e.instr
-            e = e.__cause__
+    if options.debug:
+        print(block_info)
+    return block_info
 
-        if isinstance(e, DecompFailure):
-            emsg = str(e)
-            print(emsg)
-        else:
-            tb = e.__traceback__
-            traceback.print_exception(None, e, tb)
-            emsg = str(e) or traceback.format_tb(tb)[-1]
-            emsg = emsg.strip().split("\n")[-1].strip()
-
-        error_stmts: List[Statement] = [CommentStmt(f"Error: {emsg}")]
-        if instr is not None:
-            print(
-                f"Error occurred while processing instruction: {instr}", file=sys.stderr
-            )
-            error_stmts.append(CommentStmt(f"At instruction: {instr}"))
-        print(file=sys.stderr)
-        block_info = BlockInfo(
-            to_write=error_stmts,
-            return_value=None,
-            switch_control=None,
-            branch_condition=ErrorExpr(),
-            final_register_states=state.regs,
-            has_function_call=False,
-        )
 
-    return block_info
+def translate_block_error(state: NodeState, e: Exception) -> BlockInfo:
+    """
+    Report an error that occurred while translating a block, and return a
+    BlockInfo with the error message in place of the block's contents.
+    """
+    instr: Optional[Instruction] = None
+    if isinstance(e, InstrProcessingFailure) and isinstance(e.__cause__, Exception):
+        instr = e.instr
+        e = e.__cause__
+
+    if isinstance(e, DecompFailure):
+        emsg = str(e)
+        print(emsg)
+    else:
+        tb = e.__traceback__
+        traceback.print_exception(None, e, tb)
+        emsg = str(e) or traceback.format_tb(tb)[-1]
+        emsg = emsg.strip().split("\n")[-1].strip()
+
+    error_stmts: List[Statement] = [CommentStmt(f"Error: {emsg}")]
+    if instr is not None:
+        print(f"Error occurred while processing instruction: {instr}", file=sys.stderr)
+        error_stmts.append(CommentStmt(f"At instruction: {instr}"))
+    print(file=sys.stderr)
+    return BlockInfo(
+        to_write=error_stmts,
+        return_value=None,
+        switch_control=None,
+        branch_condition=ErrorExpr(),
+        final_register_states=state.regs,
+        has_function_call=False,
+    )
 
 
 def create_dominated_node_state(
@@ -4614,8 +5005,13 @@ def create_dominated_node_state(
             RegMeta(inherited=True, force=data.meta.force, initial=data.meta.initial),
         )
 
+    # The set of nodes between the child and its dominator is needed both for
+    # phi registers and for clobbered vars; only walk the graph once.
+    dominator_path_nodes = nodes_until_dominator(child)
     phi_regs = (
-        r for r in locs_clobbered_until_dominator(child) if isinstance(r, Register)
+        r
+        for r in locs_clobbered_until_dominator(child, dominator_path_nodes)
+        if isinstance(r, Register)
     )
     for reg in phi_regs:
         if stack_info.is_planned_inherited_phi(child, reg):
@@ -4654,10 +5050,8 @@ def create_dominated_node_state(
             # translation pass. See the doc comment for NaivePhiExpr for more
             # information.
             expr: Optional[RegExpression]
-            var = stack_info.get_planned_var(reg, sources[0])
-            if var is not None and all(
-                stack_info.get_planned_var(reg, s) == var for s in sources[1:]
-            ):
+            var = stack_info.get_common_planned_var(reg, sources)
+            if var is not None:
                 expr = PlannedPhiExpr(var, var.type, sources)
             else:
                 expr = NaivePhiExpr(
@@ -4681,7 +5075,9 @@ def create_dominated_node_state(
     # using that expression requires it to be made into a temp.
     # TODO: we should really do this with other prevents as well, e.g. prevent
     # reads/calls if there are function calls along a path to the dominator.
-    clobbered_vars = vars_clobbered_until_dominator(stack_info, child)
+    clobbered_vars = vars_clobbered_until_dominator(
+        stack_info, child, dominator_path_nodes
+    )
     child_state.prevent_later_var_uses(clobbered_vars)
 
     return child_state
@@ -4762,6 +5158,13 @@ class GlobalInfo:
     persistent_function_state: Dict[str, PersistentFunctionState] = field(
         default_factory=lambda: defaultdict(PersistentFunctionState)
     )
+    # Cached results of demangle_symbol and vtable_entry_name
+    demangled_symbols: Dict[str, Optional[CxxSymbol]] = field(default_factory=dict)
+    vtable_entry_names: Dict[str, str] = field(default_factory=dict)
+    is_cxx: bool = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.is_cxx = self.target.language == Target.LanguageEnum.CXX
 
     def get_persistent_function_state(self, func_name: str) -> PersistentFunctionState:
         return self.persistent_function_state[func_name]
@@ -4769,18 +5172,35 @@ class GlobalInfo:
     def asm_data_value(self, sym_name: str) -> Optional[AsmDataEntry]:
         return self.asm_data.values.get(sym_name)
 
+    def demangle_symbol(self, sym_name: str) -> Optional[CxxSymbol]:
+        """Demangle a C++ symbol name, or return None if it cannot be parsed.
+        The same names recur e.g. across vtables, so results are cached."""
+        if sym_name in self.demangled_symbols:
+            return self.demangled_symbols[sym_name]
+        demangled_symbol: Optional[CxxSymbol]
+        try:
+            demangled_symbol = demangle_codewarrior_parse(sym_name)
+        except ValueError:
+            demangled_symbol = None
+        self.demangled_symbols[sym_name] = demangled_symbol
+        return demangled_symbol
+
     def address_of_gsym(self, sym_name: str) -> AddressOf:
-        if sym_name in self.global_symbol_map:
-            sym = self.global_symbol_map[sym_name]
-        else:
+        # The returned AddressOf is always fresh: its pointer type is a separate
+        # unification variable for each use, and depends on whether the symbol's
+        # type is (currently known to be) an array.
+        sym = self.global_symbol(sym_name)
+        return AddressOf(sym, type=sym.type.reference())
+
+    def global_symbol(self, sym_name: str) -> GlobalSymbol:
+        """Return the GlobalSymbol for a given name, creating it if necessary."""
+        sym = self.global_symbol_map.get(sym_name)
+        if sym is None:
             demangled_symbol: Optional[CxxSymbol] = None
             demangled_str: Optional[str] = None
-            if self.target.language == Target.LanguageEnum.CXX:
-                try:
-                    demangled_symbol = demangle_codewarrior_parse(sym_name)
-                except ValueError:
-                    pass
-                else:
+            if self.is_cxx:
+                demangled_symbol = self.demangle_symbol(sym_name)
+                if demangled_symbol is not None:
                     demangled_str = str(demangled_symbol)
 
             sym = self.global_symbol_map[sym_name] = GlobalSymbol(
@@ -4792,7 +5212,7 @@ class GlobalInfo:
 
             # If the symbol is a C++ vtable, try to build a custom type for it by parsing it
             if (
-                self.target.language == Target.LanguageEnum.CXX
+                self.is_cxx
                 and sym_name.startswith("__vt__")
                 and sym.asm_data_entry is not None
             ):
@@ -4822,7 +5242,23 @@ class GlobalInfo:
                     Type.demangled_symbol(self.typemap, self.typepool, demangled_symbol)
                 )
 
-        return AddressOf(sym, type=sym.type.reference())
+        return sym
+
+    def vtable_entry_name(self, entry: str) -> str:
+        """Return the field name to use for a vtable entry pointing to the symbol
+        `entry`: the unqualified demangled name if possible. The same entries
+        occur in many vtables, so this is cached."""
+        entry_name = self.vtable_entry_names.get(entry)
+        if entry_name is None:
+            entry_name = entry
+            demangled_sym = self.demangle_symbol(entry)
+            if (
+                demangled_sym is not None
+                and demangled_sym.name.qualified_name is not None
+            ):
+                entry_name = str(demangled_sym.name.qualified_name[-1])
+            self.vtable_entry_names[entry] = entry_name
+        return entry_name
 
     def vtable_type(self, sym_name: str, asm_data_entry: AsmDataEntry) -> Type:
         """
@@ -4834,6 +5270,7 @@ class GlobalInfo:
         struct = StructDeclaration.unknown(
             self.typepool, size=size, align=4, tag_name=sym_name
         )
+        field_prefix = struct.new_field_prefix
         offset = 0
         for entry in asm_data_entry.data:
             if isinstance(entry, bytes):
@@ -4842,25 +5279,20 @@ class GlobalInfo:
                     raise DecompFailure(
                         f"Unable to parse misaligned vtable data in {sym_name}"
                     )
-                for i in range(len(entry) // 4):
-                    field_name = f"{struct.new_field_prefix}{offset:X}"
+                # Each field needs its own Type, since types are unified in place
+                for field_offset in range(offset, offset + len(entry), 4):
                     struct.try_add_field(
-                        Type.reg32(likely_float=False), offset, field_name, size=4
+                        Type.reg32(likely_float=False),
+                        field_offset,
+                        f"{field_prefix}{field_offset:X}",
+                        size=4,
                     )
-                    offset += 4
+                offset += len(entry)
             else:
-                entry_name = entry
-                try:
-                    demangled_field_sym = demangle_codewarrior_parse(entry)
-                    if demangled_field_sym.name.qualified_name is not None:
-                        entry_name = str(demangled_field_sym.name.qualified_name[-1])
-                except ValueError:
-                    pass
-
                 field = struct.try_add_field(
                     self.address_of_gsym(entry).type,
                     offset,
-                    name=entry_name,
+                    name=self.vtable_entry_name(entry),
                     size=4,
                 )
                 assert field is not None
@@ -4879,35 +5311,82 @@ class GlobalInfo:
         self, sym: GlobalSymbol, fmt: Formatter
     ) -> Optional[str]:
         assert sym.asm_data_entry is not None
-        data = sym.asm_data_entry.data[:]
+        sym_type = sym.type
+        if not (sym_type.is_struct() or sym_type.is_array() or sym_type.is_reg()):
+            # Functions, void and not yet resolved types don't have initializers
+            return None
+        data = sym.asm_data_entry.data
+        # Position of the next unread entry of `data`, and the number of bytes
+        # already read from it if it is a bytes object. (This avoids copying
+        # the remaining data on every read.)
+        index = 0
+        byte_offset = 0
 
         def read_uint(n: int) -> Optional[int]:
             """Read the next `n` bytes from `data` as an (long) integer"""
+            nonlocal index, byte_offset
             assert 0 < n <= 8
-            if not data or not isinstance(data[0], bytes):
+            if index >= len(data):
+                return None
+            chunk = data[index]
+            if not isinstance(chunk, bytes):
                 return None
-            if len(data[0]) < n:
+            end = byte_offset + n
+            if len(chunk) < end:
                 return None
-            bs = data[0][:n]
-            data[0] = data[0][n:]
-            if not data[0]:
-                del data[0]
-            value = 0
-            for b in bs:
-                value = (value << 8) | b
+            value = int.from_bytes(chunk[byte_offset:end], "big")
+            if end == len(chunk):
+                index += 1
+                byte_offset = 0
+            else:
+                byte_offset = end
             return value
 
         def read_pointer() -> Optional[Expression]:
             """Read the next label from `data`"""
-            if not data or not isinstance(data[0], str):
+            nonlocal index
+            if index >= len(data):
                 return None
-
-            label = data[0]
-            data.pop(0)
+            label = data[index]
+            if not isinstance(label, str):
+                return None
+            index += 1
             return self.address_of_gsym(label)
 
+        def for_scalar(type: Type, size: int) -> Optional[str]:
+            """Return the initializer for a single element of reg type `type`, which
+            has size `size`"""
+            if size == 4:
+                ptr = read_pointer()
+                if ptr is not None:
+                    return as_type(ptr, type, silent=True).format(fmt)
+
+            value = read_uint(size)
+            if value is not None:
+                enum_name = type.get_enum_name(value)
+                if enum_name is not None:
+                    return enum_name
+                expr = as_type(Literal(value), type, True)
+                return elide_literal_casts(expr).format(fmt)
+            return None
+
         def for_type(type: Type) -> Optional[str]:
             """Return the initializer for a single element of type `type`"""
+            element_type, array_dim = type.get_array()
+            if element_type is not None and array_dim and element_type.is_reg():
+                # Fast path for arrays of scalars, which can be large: look at the
+                # element type just once.
+                size = element_type.get_size_bytes()
+                if not size:
+                    return None
+                members = []
+                for _ in range(array_dim):
+                    m = for_scalar(element_type, size)
+                    if m is None:
+                        return None
+                    members.append(m)
+                return fmt.format_array(members)
+
             if type.is_struct() or type.is_array():
                 struct_fields = type.get_initializer_fields()
                 if not struct_fields:
@@ -4931,28 +5410,17 @@ class GlobalInfo:
                 size = type.get_size_bytes()
                 if not size:
                     return None
-
-                if size == 4:
-                    ptr = read_pointer()
-                    if ptr is not None:
-                        return as_type(ptr, type, silent=True).format(fmt)
-
-                value = read_uint(size)
-                if value is not None:
-                    enum_name = type.get_enum_name(value)
-                    if enum_name is not None:
-                        return enum_name
-                    expr = as_type(Literal(value), type, True)
-                    return elide_literal_casts(expr).format(fmt)
+                return for_scalar(type, size)
 
             # Type kinds K_FN and K_VOID do not have initializers
             return None
 
-        return for_type(sym.type)
+        return for_type(sym_type)
 
     def find_forward_declares_needed(self, functions: List[FunctionInfo]) -> Set[str]:
         funcs_seen = set()
         forward_declares_needed = self.asm_data.mentioned_labels
+        local_functions = self.local_functions
 
         for func in functions:
             funcs_seen.add(func.stack_info.function.name)
@@ -4971,9 +5439,8 @@ class GlobalInfo:
                     else:
                         continue
 
-                    if func_name in self.local_functions:
-                        if func_name not in funcs_seen:
-                            forward_declares_needed.add(func_name)
+                    if func_name in local_functions and func_name not in funcs_seen:
+                        forward_declares_needed.add(func_name)
 
         return forward_declares_needed
 
@@ -4988,19 +5455,19 @@ class GlobalInfo:
         # to be added to the global_symbol_map.
         forward_declares_needed = self.find_forward_declares_needed(functions)
 
-        lines = []
+        # Declarations are sorted by (not is_function, is_global, is_in_file,
+        # is_const, name). The flags only make for 16 combinations, so bucket
+        # the lines by them, and sort each bucket by name.
+        buckets: List[List[Tuple[str, str]]] = [[] for _ in range(16)]
+        all_decls = decls == Options.GlobalDeclsEnum.ALL
         processed_names: Set[str] = set()
-        while True:
-            names: AbstractSet[str] = self.global_symbol_map.keys()
-            if decls == Options.GlobalDeclsEnum.ALL:
-                names |= self.asm_data.values.keys()
-            names -= processed_names
-            if not names:
-                break
+        names: AbstractSet[str] = self.global_symbol_map.keys()
+        if all_decls:
+            names |= self.asm_data.values.keys()
+        while names:
             for name in sorted(names):
                 processed_names.add(name)
-                sym = self.address_of_gsym(name).expr
-                assert isinstance(sym, GlobalSymbol)
+                sym = self.global_symbol(name)
                 data_entry = sym.asm_data_entry
 
                 # Is the label defined in this unit (in the active AsmData file(s))
@@ -5024,13 +5491,12 @@ class GlobalInfo:
                     continue
 
                 # TODO: Use original AsmFile ordering for variables
-                sort_order = (
-                    not sym.type.is_function(),
-                    is_global,
-                    is_in_file,
-                    is_const,
-                    name,
-                )
+                bucket = buckets[
+                    (not sym.type.is_function()) << 3
+                    | is_global << 2
+                    | is_in_file << 1
+                    | is_const
+                ]
                 qualifier = ""
                 value: Optional[str] = None
                 comments = []
@@ -5074,8 +5540,8 @@ class GlobalInfo:
                             )
                         elif potential_dim > 1 or is_vla:
                             # NB: In general, replacing the types of Expressions can be sketchy.
-                            # However, the GlobalSymbol here came from address_of_gsym(), which
-                            # always returns a reference to the element_type.
+                            # However, the GlobalSymbol here came from global_symbol(), and
+                            # address_of_gsym() always returns a reference to the element_type.
                             array_dim = potential_dim
                             sym.type = Type.array(element_type, array_dim)
 
@@ -5105,14 +5571,10 @@ class GlobalInfo:
                 if decls == Options.GlobalDeclsEnum.NONE:
                     continue
                 # In modes except "all", skip the decl if the context file already had an initializer
-                if decls != Options.GlobalDeclsEnum.ALL and sym.initializer_in_typemap:
+                if not all_decls and sym.initializer_in_typemap:
                     continue
                 # In modes except "all", skip vtable decls when compiling C++
-                if (
-                    decls != Options.GlobalDeclsEnum.ALL
-                    and self.target.language == Target.LanguageEnum.CXX
-                    and name.startswith("__vt__")
-                ):
+                if not all_decls and self.is_cxx and name.startswith("__vt__"):
                     continue
 
                 if (
@@ -5125,9 +5587,9 @@ class GlobalInfo:
 
                 qualifier = f"{qualifier} " if qualifier else ""
                 value = f" = {value}" if value else ""
-                lines.append(
+                bucket.append(
                     (
-                        sort_order,
+                        name,
                         fmt.with_comments(
                             f"{qualifier}{sym.type.to_decl(name, fmt)}{value};",
                             comments,
@@ -5135,8 +5597,13 @@ class GlobalInfo:
                         + "\n",
                     )
                 )
-        lines.sort()
-        return "".join(line for _, line in lines)
+
+            # Formatting initializers may have added new symbols. The asm data
+            # symbols do not change, so only global_symbol_map needs rechecking.
+            names = self.global_symbol_map.keys() - processed_names
+        for bucket in buckets:
+            bucket.sort()
+        return "".join(line for bucket in buckets for _, line in bucket)
 
 
 def narrow_func_call_outputs(
@@ -5161,17 +5628,29 @@ def setup_planned_vars(
     stack_info: StackInfo, persistent_state: PersistentFunctionState
 ) -> None:
     """Set up stack_info planned vars from state from earlier translation passes."""
-    planned_vars = defaultdict(list)
+    deterministic_vars = stack_info.global_info.deterministic_vars
+    planned_vars: Dict[PlannedVar, List[Tuple[Register, InstructionSource]]] = {}
+    # The minimum line number of each group's sources, for deterministic names
+    min_linenos: Dict[PlannedVar, int] = {}
     for key, persistent_var in persistent_state.planned_vars.items():
-        planned_vars[persistent_var.get_representative()].append(key)
-
-    for keys in planned_vars.values():
+        rep = persistent_var.get_representative()
+        keys = planned_vars.get(rep)
+        if keys is None:
+            planned_vars[rep] = [key]
+        else:
+            keys.append(key)
+        if deterministic_vars:
+            instr = key[1]
+            lineno = 0 if instr is None else instr.meta.lineno
+            if rep not in min_linenos or lineno < min_linenos[rep]:
+                min_linenos[rep] = lineno
+
+    for rep, keys in planned_vars.items():
         reg = keys[0][0]
         reg_name = stack_info.function.reg_formatter.format(reg)
         prefix = f"var_{reg_name}"
-        if stack_info.global_info.deterministic_vars:
-            lineno = min(0 if instr is None else instr.meta.lineno for _, instr in keys)
-            prefix = f"{prefix}_{lineno}"
+        if deterministic_vars:
+            prefix = f"{prefix}_{min_linenos[rep]}"
         var = Var(
             stack_info,
             prefix=prefix,
@@ -5255,6 +5734,7 @@ def translate_to_ast(
     """
     persistent_state = global_info.get_persistent_function_state(function.name)
     stack_info = get_stack_info(function, persistent_state, global_info, flow_graph)
+    stack_info.keep_debug_exprs = options.pdb_translate
     state = NodeState(
         node=flow_graph.entry_node(),
         regs=RegInfo(stack_info=stack_info),
@@ -5264,8 +5744,7 @@ def translate_to_ast(
     setup_planned_vars(stack_info, persistent_state)
     setup_reg_vars(stack_info, options)
 
-    fn_sym = global_info.address_of_gsym(function.name).expr
-    assert isinstance(fn_sym, GlobalSymbol)
+    fn_sym = global_info.global_symbol(function.name)
 
     fn_type = fn_sym.type
     fn_type.unify(Type.function())
@@ -5287,8 +5766,13 @@ def translate_to_ast(
 
     # Guess return register and mark returns (we should really base this on
     # function signature if known, but so far the heuristic is reliable enough)
+    final_states: Dict[Node, RegInfo] = {
+        n: get_block_info(n).final_register_states
+        for n in flow_graph.nodes
+        if not isinstance(n, TerminalNode)
+    }
     for reg in arch.base_return_regs:
-        propagate_register_meta(flow_graph.nodes, reg)
+        propagate_register_meta(final_states, reg)
 
     return_type = fn_sig.return_type
     return_reg: Optional[Register] = None
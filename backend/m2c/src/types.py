@@ -196,6 +196,8 @@ class Type:
     become floats.
     """
 
+    # Types are allocated in large numbers, and only wrap a TypeData
+    __slots__ = ("_data",)
     _data: TypeData
 
     def unify(self, other: "Type", *, seen: Optional[Set["TypeData"]] = None) -> bool: